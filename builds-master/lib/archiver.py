@@ -0,0 +1,220 @@
+# Copyright (C) IBM Corp. 2016.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from distutils.spawn import find_executable
+import logging
+import os
+import subprocess
+import tarfile
+import tempfile
+
+from lib import exception
+
+LOG = logging.getLogger(__name__)
+TAR_BLOCK_SIZE = 512
+TAR_END_OF_ARCHIVE = "\0" * TAR_BLOCK_SIZE * 2
+CHUNK_SIZE = 64 << 10
+# parallel gzip implementation, using all processors
+PARALLEL_COMPRESSOR = "pigz"
+COMPRESSOR = "gzip"
+
+
+def get_compress_command():
+    """
+    Get the command which compresses its standard input to its standard
+    output in gzip format, preferring a parallel implementation. The
+    gzip header has no name or timestamp, so that the output depends
+    only on the input.
+    """
+    if find_executable(PARALLEL_COMPRESSOR):
+        return [PARALLEL_COMPRESSOR, "-c", "-n"]
+    return [COMPRESSOR, "-c", "-n"]
+
+
+class CommandTar(object):
+    """
+    Tar stream written to standard output by a command.
+    """
+
+    def __init__(self, args, cwd=None):
+        self.args = args
+        self.cwd = cwd
+
+    def __repr__(self):
+        return "'%s' at %s" % (" ".join(self.args), self.cwd)
+
+    def append_to(self, output_file):
+        _append_command_tar(self.args, self.cwd, output_file)
+
+
+class DirectoryTar(object):
+    """
+    Tar stream of a directory content, reproducible regardless of files
+    timestamps and owners: members are sorted by name, belong to root
+    and have the same modification time.
+    """
+
+    def __init__(self, dir_path, prefix, exclude_names=(), mtime=0):
+        self.dir_path = dir_path
+        self.prefix = prefix
+        self.exclude_names = exclude_names
+        self.mtime = mtime
+
+    def __repr__(self):
+        return self.dir_path
+
+    def append_to(self, output_file):
+        paths = [""]
+        while paths:
+            relative_path = paths.pop(0)
+            path = os.path.join(self.dir_path, relative_path)
+            self._append_member(path, relative_path, output_file)
+            if os.path.isdir(path) and not os.path.islink(path):
+                paths[0:0] = [
+                    os.path.join(relative_path, name)
+                    for name in sorted(os.listdir(path))
+                    if name not in self.exclude_names]
+
+    def _append_member(self, path, relative_path, output_file):
+        name = os.path.join(self.prefix, relative_path).rstrip("/")
+        tar_info = tarfile.TarInfo(name)
+        tar_info.mtime = self.mtime
+        tar_info.uid = tar_info.gid = 0
+        tar_info.uname = tar_info.gname = "root"
+        if os.path.islink(path):
+            tar_info.type = tarfile.SYMTYPE
+            tar_info.linkname = os.readlink(path)
+            tar_info.mode = 0777
+        elif os.path.isdir(path):
+            tar_info.type = tarfile.DIRTYPE
+            tar_info.mode = 0755
+        else:
+            tar_info.size = os.path.getsize(path)
+            tar_info.mode = 0755 if os.access(path, os.X_OK) else 0644
+        output_file.write(tar_info.tobuf(tarfile.GNU_FORMAT))
+
+        if tar_info.isreg():
+            with open(path, "rb") as input_file:
+                for chunk in iter(lambda: input_file.read(CHUNK_SIZE), b""):
+                    output_file.write(chunk)
+            padding_size = -tar_info.size % TAR_BLOCK_SIZE
+            output_file.write("\0" * padding_size)
+
+
+def create_tar_gz(archive_file_path, tars):
+    """
+    Create a gzipped tar archive from tar streams, in a single pass: the
+    members of each stream are appended to a single tar stream, piped to
+    the compressor.
+
+    Args:
+        archive_file_path (str): archive file path
+        tars ([CommandTar or DirectoryTar]): tar streams
+
+    Raises:
+        exception.SubprocessError: if a command fails
+    """
+    compress_args = get_compress_command()
+    archive_dir = os.path.dirname(os.path.abspath(archive_file_path))
+    temp_file_descriptor, temp_file_path = tempfile.mkstemp(
+        dir=archive_dir, prefix=".archive-")
+    try:
+        with os.fdopen(temp_file_descriptor, "wb") as temp_file:
+            compressor = subprocess.Popen(
+                compress_args, stdin=subprocess.PIPE, stdout=temp_file)
+            try:
+                for tar in tars:
+                    LOG.debug("Archiving %s" % tar)
+                    tar.append_to(compressor.stdin)
+                compressor.stdin.write(TAR_END_OF_ARCHIVE)
+            finally:
+                compressor.stdin.close()
+                compressor.wait()
+        if compressor.returncode != 0:
+            raise exception.SubprocessError(
+                cmd=" ".join(compress_args), returncode=compressor.returncode,
+                stdout="", stderr="")
+        os.chmod(temp_file_path, 0644)
+        os.rename(temp_file_path, archive_file_path)
+    except:
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+        raise
+
+
+def _append_command_tar(args, cwd, output_file):
+    """
+    Copy the members of the tar stream written by a command to a file,
+    without the end of archive blocks.
+    """
+    # a file, instead of a pipe, avoids blocking the command if it writes
+    # too much to standard error
+    with tempfile.TemporaryFile() as stderr_file:
+        process = subprocess.Popen(args, cwd=cwd, stdout=subprocess.PIPE,
+                                   stderr=stderr_file)
+        try:
+            complete = _copy_tar_members(process.stdout, output_file)
+            # drain the end of archive and any padding
+            while process.stdout.read(CHUNK_SIZE):
+                pass
+        finally:
+            process.stdout.close()
+            process.wait()
+        stderr_file.seek(0)
+        stderr = stderr_file.read()
+    if process.returncode != 0 or not complete:
+        raise exception.SubprocessError(
+            cmd=" ".join(args), returncode=process.returncode, stdout="",
+            stderr=stderr or "incomplete tar stream")
+
+
+def _copy_tar_members(input_file, output_file):
+    """
+    Copy tar members, headers and data blocks, from one file to another,
+    until the end of archive.
+
+    Returns:
+        bool: whether the end of archive was found
+    """
+    while True:
+        header = input_file.read(TAR_BLOCK_SIZE)
+        if len(header) < TAR_BLOCK_SIZE:
+            return False
+        if header == TAR_END_OF_ARCHIVE[:TAR_BLOCK_SIZE]:
+            return True
+        output_file.write(header)
+
+        remaining_size = _get_member_blocks(header) * TAR_BLOCK_SIZE
+        while remaining_size:
+            chunk = input_file.read(min(CHUNK_SIZE, remaining_size))
+            if not chunk:
+                return False
+            output_file.write(chunk)
+            remaining_size -= len(chunk)
+
+
+def _get_member_blocks(header):
+    """
+    Get the number of data blocks following a tar member header.
+    """
+    size_field = header[124:136]
+    if ord(size_field[0]) & 0x80:
+        # GNU base-256 encoding, used for sizes of 8 GiB or more
+        size = 0
+        for char in size_field[1:]:
+            size = size * 256 + ord(char)
+    else:
+        size = int(size_field.strip(" \0") or "0", 8)
+    return (size + TAR_BLOCK_SIZE - 1) // TAR_BLOCK_SIZE
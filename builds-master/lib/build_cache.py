@@ -0,0 +1,182 @@
+# Copyright (C) IBM Corp. 2016.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import logging
+import os
+import shutil
+import httplib
+import tempfile
+
+from lib import exception
+from lib import package_source
+from lib import utils
+
+LOG = logging.getLogger(__name__)
+
+
+class BuildCache(object):
+    """
+    Cache of built RPMs, keyed by a fingerprint of everything used to
+    build a package: its metadata, spec file, build files, RPM macros,
+    source code commit IDs or checksums and the fingerprints of its
+    build dependencies.
+    """
+
+    def __init__(self, cache_dir, distro, environment_files=None):
+        """
+        Args:
+            cache_dir (str): directory where built RPMs are stored
+            distro (LinuxDistribution): distro packages are built for
+            environment_files ([str]): files which affect every build,
+                such as build system configuration files
+        """
+        self.cache_dir = cache_dir
+        self.distro = distro
+        self.environment_files = environment_files or []
+        self._fingerprints = {}
+
+    def fingerprint(self, package):
+        """
+        Get the fingerprint of the package build inputs. Packages whose
+        sources are not pinned to a commit ID, or whose URL sources
+        without checksum can not be downloaded, can not be cached, None
+        is returned for them and for the packages depending on them.
+        """
+        if package.name not in self._fingerprints:
+            self._fingerprints[package.name] = self._compute_fingerprint(
+                package)
+        return self._fingerprints[package.name]
+
+    def _compute_fingerprint(self, package):
+        digest = hashlib.sha256()
+
+        def _update(*values):
+            for value in values:
+                digest.update("%s\0" % (value,))
+
+        _update(self.distro.lsb_name, self.distro.version)
+        for file_path in self.environment_files + [
+                package.package_file, package.spec_file.path,
+                package.rpmmacro]:
+            _update(file_path and os.path.basename(file_path))
+            if file_path:
+                _update(utils.compute_file_checksum(file_path))
+
+        if package.build_files:
+            for root, dirs, files in os.walk(package.build_files):
+                dirs.sort()
+                for file_name in sorted(files):
+                    file_path = os.path.join(root, file_name)
+                    _update(os.path.relpath(file_path, package.build_files),
+                            utils.compute_file_checksum(file_path))
+        _update(*package.download_build_files)
+
+        for source in package.sources:
+            source_type, source_data = source.items()[0]
+            if source_type == "url":
+                checksum = (source_data.get("checksum") or
+                            _get_url_checksum(package, source_data["src"]))
+                if checksum is None:
+                    return None
+                _update(source_type, source_data["src"], checksum)
+            elif source_data.get("commit_id"):
+                _update(source_type, source_data["src"],
+                        source_data["commit_id"])
+            else:
+                LOG.debug("%s: Source %s is not pinned to a commit, the "
+                          "package build can not be cached"
+                          % (package.name, source_data["src"]))
+                return None
+        if package.clone_url or package.download_source:
+            if not package.commit_id or package.download_source:
+                return None
+            _update(package.clone_url, package.commit_id)
+
+        for dep in sorted(package.build_dependencies):
+            dep_fingerprint = self.fingerprint(dep)
+            if dep_fingerprint is None:
+                return None
+            _update(dep.name, dep_fingerprint)
+
+        return digest.hexdigest()
+
+    def _get_entry_dir(self, package):
+        fingerprint = self.fingerprint(package)
+        if fingerprint is None:
+            return None
+        return os.path.join(self.cache_dir, package.name, fingerprint)
+
+    def restore(self, package, result_dir):
+        """
+        Copy the cached RPMs of a package to the result directory,
+        adding them to the package result packages.
+
+        Returns:
+            bool: whether the package build was found in the cache
+        """
+        entry_dir = self._get_entry_dir(package)
+        if entry_dir is None or not os.path.isdir(entry_dir):
+            return False
+
+        LOG.info("%s: Found cached build, restoring RPMs to %s"
+                 % (package.name, result_dir))
+        utils.create_directory(result_dir)
+        for file_name in sorted(os.listdir(entry_dir)):
+            dest = os.path.join(result_dir, file_name)
+            utils.link_or_copy(os.path.join(entry_dir, file_name), dest)
+            package.result_packages.append(dest)
+        return True
+
+    def store(self, package):
+        """
+        Store the RPMs built for a package in the cache.
+        """
+        entry_dir = self._get_entry_dir(package)
+        if entry_dir is None or os.path.isdir(entry_dir):
+            return
+
+        LOG.info("%s: Storing built RPMs in build cache" % package.name)
+        utils.create_directory(os.path.dirname(entry_dir))
+        temp_dir = tempfile.mkdtemp(dir=os.path.dirname(entry_dir))
+        try:
+            for rpm_path in package.result_packages:
+                utils.link_or_copy(rpm_path, os.path.join(
+                    temp_dir, os.path.basename(rpm_path)))
+            os.chmod(temp_dir, 0775)
+            os.rename(temp_dir, entry_dir)
+        except OSError:
+            LOG.warning("%s: Failed to store built RPMs in build cache"
+                        % package.name)
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def _get_url_checksum(package, url):
+    """
+    Get the checksum of the file at a URL, downloading it to the
+    downloads cache if the cached copy is missing or outdated.
+
+    Returns:
+        str: checksum, in the form "<algorithm>:<hex digest>", or None if
+            the file could not be downloaded
+    """
+    try:
+        file_path = package_source.get_cached_url_file(url)
+    except (exception.DownloadError, EnvironmentError,
+            httplib.HTTPException) as exc:
+        LOG.warning("%s: Failed to download %s, the package build can not "
+                    "be cached: %s" % (package.name, url, exc))
+        return None
+    return "sha256:%s" % utils.compute_file_checksum(file_path)
@@ -0,0 +1,61 @@
+# Copyright (C) IBM Corp. 2016.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+
+import yaml
+
+from lib import utils
+
+LOG = logging.getLogger(__name__)
+
+
+class BuildDurations(object):
+    """
+    Durations, in seconds, of the last successful build of each package,
+    persisted across runs in a YAML file.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.durations = {}
+        if os.path.isfile(self.file_path):
+            try:
+                with open(self.file_path) as durations_file:
+                    self.durations = yaml.safe_load(durations_file) or {}
+            except (IOError, yaml.YAMLError):
+                LOG.warning("Failed to read build durations from %s, "
+                            "ignoring them" % self.file_path)
+
+    def record(self, durations):
+        """
+        Update packages build durations.
+
+        Args:
+            durations (dict): build duration of each package name
+        """
+        self.durations.update(durations)
+
+    def save(self):
+        LOG.debug("Saving build durations at %s" % self.file_path)
+        try:
+            utils.create_directory(os.path.dirname(self.file_path))
+            utils.write_file_atomically(
+                self.file_path, yaml.safe_dump(self.durations,
+                                               default_flow_style=False))
+        except (IOError, OSError):
+            LOG.warning("Failed to save build durations at %s"
+                        % self.file_path)
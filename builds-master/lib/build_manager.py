@@ -14,20 +14,28 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import os
 
 import lib.centos
+from lib import config
 from lib import exception
 import lib.scheduler
+from lib.build_cache import BuildCache
+from lib.build_durations import BuildDurations
 from lib.packages_manager import PackagesManager
 from lib.rpm_package import RPM_Package
 
+CONF = config.get_config().CONF
 LOG = logging.getLogger(__name__)
+BUILD_CACHE_DIR_NAME = "builds"
+BUILD_DURATIONS_FILE_NAME = "build_durations.yaml"
 
 
 class BuildManager(object):
-    def __init__(self, packages_names, distro):
+    def __init__(self, packages_names, distro, jobs=1):
         self.packages_manager = PackagesManager(packages_names)
         self.distro = distro
+        self.jobs = jobs
         self.repositories = None
 
     def __call__(self):
@@ -46,5 +54,20 @@ class BuildManager(object):
         self.build()
 
     def build(self):
-        scheduler = lib.scheduler.Scheduler()
-        self.distro.build_packages(scheduler(self.packages_manager.packages))
+        cache_path = CONF.get('default').get('cache_path')
+        build_durations = BuildDurations(os.path.join(
+            cache_path, BUILD_DURATIONS_FILE_NAME))
+        if CONF.get('default').get('build_cache'):
+            build_cache = BuildCache(
+                os.path.join(cache_path, BUILD_CACHE_DIR_NAME), self.distro,
+                environment_files=[self.distro.package_builder.config_file])
+        else:
+            build_cache = None
+        scheduler = lib.scheduler.Scheduler(build_durations.durations)
+        try:
+            self.distro.build_packages(
+                scheduler(self.packages_manager.packages), jobs=self.jobs,
+                build_cache=build_cache)
+        finally:
+            build_durations.record(self.distro.build_durations)
+            build_durations.save()
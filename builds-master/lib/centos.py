@@ -32,6 +32,9 @@ class CentOS(distro.LinuxDistribution):
     def __init__(self, name, version, arch_and_endianness):
         super(CentOS, self).__init__(name=name, version=version,
                                      arch_and_endianness=arch_and_endianness)
-        config_file = CONF.get('default').get('mock_config').get(name).get(
-            version)
-        self.package_builder = mockbuilder.Mock(config_file)
+        self.mock_config_file = CONF.get('default').get('mock_config').get(
+            name).get(version)
+        self.package_builder = self.create_package_builder()
+
+    def create_package_builder(self, unique_extension=None):
+        return mockbuilder.Mock(self.mock_config_file, unique_extension)
@@ -21,6 +21,7 @@ import sys
 import yaml
 
 from lib import log_helper
+from lib import metadata_index
 from lib import utils
 
 LOG = logging.getLogger(__name__)
@@ -46,9 +47,24 @@ PACKAGE_ARGS = {
     ('--repositories-path', '-R'):
         dict(help='Directory where to clone code repositories',
              default='/var/lib/host-os/repositories'),
+    ('--cache-path',):
+        dict(help='Directory where to store data reused across builds',
+             default='/var/lib/host-os/cache'),
     ('--keep-builddir',):
         dict(help='Keep build directory and its logs and artifacts.',
              action='store_true'),
+    ('--no-build-cache',):
+        dict(help='Build all packages, even the ones built before with the '
+             'same inputs',
+             action='store_false', dest='build_cache'),
+    ('--changed-since',):
+        dict(help='Build only the packages changed in the packages metadata '
+             'git repository since this commit, and the packages depending '
+             'on them'),
+    ('--jobs', '-j'):
+        dict(help='Number of packages built at the same time, each one in '
+             'its own chroot',
+             type=int, default=1),
 }
 MOCK_ARGS = {
     ('--mock-args',):
@@ -80,6 +96,15 @@ PUSH_REPO_ARGS = {
         dict(help='Email used when updating RPM specification files change logs '
              'and creating git commits'),
 }
+UPGRADE_VERSIONS_ARGS = {
+    ('--jobs', '-j'):
+        dict(help='Number of packages checked for updates at the same time',
+             type=int, default=4),
+    ('--max-change-log-entries',):
+        dict(help='Maximum number of commits listed in the change log entry '
+             'of a package update',
+             type=int, default=100),
+}
 SETUP_ENVIRONMENT_ARGS = {
     ('--user', '-u'):
         dict(help='User login that will run Host OS commands',
@@ -96,7 +121,7 @@ SUBCOMMANDS = [
     ('release-notes', 'Create release notes',
         [RELEASE_NOTES_ARGS, PUSH_REPO_ARGS, BUILD_REPO_ARGS]),
     ('upgrade-versions', 'Upgrade packages versions',
-        [PUSH_REPO_ARGS, BUILD_REPO_ARGS]),
+        [UPGRADE_VERSIONS_ARGS, PUSH_REPO_ARGS, BUILD_REPO_ARGS]),
     ('set-env', 'Setup user and directory for build scripts',
         [SETUP_ENVIRONMENT_ARGS]),
     ('build-iso', 'Build ISO image',
@@ -137,6 +162,10 @@ def discover_packages():
     "kernel" and "libvirt" will be discovered, "not-a-package" and "file"
     will not.
     """
+    index = metadata_index.get_index()
+    if index is not None:
+        return index.get_discoverable_packages()
+
     config = get_config().CONF.get('default')
     versions_repo_url = config.get('build_versions_repository_url')
     versions_repo_name = os.path.basename(os.path.splitext(versions_repo_url)[0])
@@ -13,10 +13,14 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from functools import partial
 import abc
 import logging
+import threading
+import time
 
 from lib import exception
+from lib import packages_manager
 
 LOG = logging.getLogger(__name__)
 # NOTE(maurosr): make it a constant since we only plan to work with little
@@ -35,6 +39,8 @@ class LinuxDistribution(object):
         """
         self.lsb_name = name
         self.package_builder = None
+        # duration, in seconds, of each successful package build
+        self.build_durations = {}
         if arch_and_endianness.upper() not in SUPPORTED_ARCH_AND_ENDIANNESS:
             raise exception.DistributionVersionNotSupportedError(
                 msg="Endianness not supported: %s" % arch_and_endianness)
@@ -50,20 +56,241 @@ class LinuxDistribution(object):
         LOG.info("Distribution detected: %(lsb_name)s %(version)s" %
                  vars(self))
 
-    def build_packages(self, packages):
+    @abc.abstractmethod
+    def create_package_builder(self, unique_extension=None):
+        """
+        Create a new package builder. Builders created with different
+        unique extensions do not share their build environment.
+        """
+
+    def build_packages(self, packages, jobs=1, build_cache=None):
         """
         This is were distro and builder interact and produce the packages we
         want.
+
+        Args:
+            packages ([Package]): packages to build, in scheduled order
+            jobs (int): maximum number of packages built at the same time
+            build_cache (BuildCache): cache of previous builds results
         """
+        if build_cache:
+            packages = self._restore_cached_builds(packages, build_cache)
+            if not packages:
+                LOG.info("All packages restored from build cache")
+                return
+
+        # download all packages files up front and concurrently; the
+        # following per-package downloads only check out the sources
+        # again, as their working copies may be shared among packages.
+        # Git sources are archived straight from their repositories, so
+        # they are not checked out.
+        packages_manager.download_packages(
+            packages, recurse=False, working_tree=False)
+
+        if jobs > 1 and len(packages) > 1:
+            self._build_packages_in_parallel(packages, jobs, build_cache)
+            return
+
         self.package_builder.initialize()
         for package in packages:
+            start_time = time.time()
             package.lock()
-            package.download_files(recurse=False)
+            package.download_files(
+                recurse=False, working_tree=False, build_files=False)
             self.package_builder.prepare_sources(package)
             package.unlock()
             self.package_builder.build(package)
+            self.build_durations[package.name] = time.time() - start_time
+            if build_cache:
+                build_cache.store(package)
 
         self.clean(packages)
 
+    def _restore_cached_builds(self, packages, build_cache):
+        """
+        Restore the results of packages whose build inputs did not
+        change since a previous build.
+
+        Returns:
+            [Package]: packages not found in the build cache
+        """
+        # compute fingerprints before building anything, because
+        # preparing packages sources changes their data
+        for package in packages:
+            build_cache.fingerprint(package)
+        return [package for package in packages if not build_cache.restore(
+            package, self.package_builder.result_dir)]
+
+    def _build_packages_in_parallel(self, packages, jobs, build_cache=None):
+        """
+        Build packages using up to [jobs] package builders, each one
+        with its own build environment. A package starts building as
+        soon as all its build dependencies have been built.
+        """
+        builders = [self.create_package_builder("%s-%d" % (
+                        self.package_builder.timestamp, index))
+                    for index in range(min(jobs, len(packages)))]
+        LOG.info("Building packages using %d parallel jobs" % len(builders))
+        try:
+            _run_in_threads([builder.initialize for builder in builders])
+
+            build = _ParallelBuild(packages, build_cache)
+            try:
+                _run_in_threads([partial(build.run_worker, builder)
+                                 for builder in builders])
+            finally:
+                self.build_durations.update(
+                    (package.name, build.durations[package.name])
+                    for package in build.built_packages)
+            build.report()
+            unbuilt_packages = build.failed_packages + build.skipped_packages
+            if unbuilt_packages:
+                raise exception.PackageBuildError(
+                    packages=", ".join(p.name for p in unbuilt_packages))
+        finally:
+            for builder in builders:
+                try:
+                    builder.clean()
+                except Exception:
+                    # not hiding the build error, if any
+                    LOG.exception("Failed to clean build environment")
+
     def clean(self, packages):
         self.package_builder.clean()
+
+
+def _run_in_threads(functions):
+    """
+    Run each function in its own thread, waiting for all of them to
+    finish. The first exception raised by a function, if any, is
+    re-raised.
+    """
+    errors = []
+
+    def _run(function):
+        try:
+            function()
+        except Exception as exc:
+            LOG.exception("Parallel task failed")
+            errors.append(exc)
+
+    threads = [threading.Thread(target=_run, args=(function,))
+               for function in functions]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        # join with timeout, so that the main thread is still able to
+        # handle signals
+        while thread.is_alive():
+            thread.join(1)
+    if errors:
+        raise errors[0]
+
+
+def _uses_working_copies(package):
+    """
+    Check if preparing a package sources uses files shared with other
+    packages, e.g. repositories working copies. Git sources are
+    archived without their working trees.
+    """
+    return bool(package.clone_url or any(
+        source.keys() != ["git"] for source in package.sources))
+
+
+class _ParallelBuild(object):
+    """
+    Shared state of a parallel build. Workers pick the first pending
+    package, in scheduled order, whose build dependencies are built.
+    """
+
+    def __init__(self, packages, build_cache=None):
+        self.build_cache = build_cache
+        self.pending_packages = list(packages)
+        self.scheduled_packages = list(packages)
+        self.built_packages = []
+        self.failed_packages = []
+        self.skipped_packages = []
+        self.durations = {}
+        self._condition = threading.Condition()
+        # package preparation handles shared resources (e.g. source code
+        # repositories), so it is done by one worker at a time
+        self._prepare_lock = threading.Lock()
+
+    def run_worker(self, builder):
+        while True:
+            package = self._acquire_package()
+            if package is None:
+                return
+            start_time = time.time()
+            try:
+                with self._prepare_lock:
+                    package.lock()
+                    try:
+                        package.download_files(
+                            recurse=False, working_tree=False,
+                            build_files=False)
+                        if _uses_working_copies(package):
+                            builder.prepare_sources(package)
+                    finally:
+                        package.unlock()
+                if not _uses_working_copies(package):
+                    # archiving from the object store needs no locking
+                    builder.prepare_sources(package)
+                builder.build(package)
+                if self.build_cache:
+                    self.build_cache.store(package)
+            except Exception:
+                LOG.exception("%s: Build failed" % package.name)
+                succeeded = False
+            else:
+                succeeded = True
+            self._release_package(
+                package, succeeded, time.time() - start_time)
+
+    def _acquire_package(self):
+        """
+        Wait until a package is ready to be built and remove it from the
+        pending packages. Return None if there are no more packages.
+        """
+        with self._condition:
+            while self.pending_packages:
+                for package in list(self.pending_packages):
+                    dependencies = [
+                        dep for dep in package.build_dependencies
+                        if dep in self.scheduled_packages]
+                    if any(dep in self.failed_packages or
+                           dep in self.skipped_packages
+                           for dep in dependencies):
+                        LOG.error("%s: Skipping build, because a build "
+                                  "dependency failed" % package.name)
+                        self.pending_packages.remove(package)
+                        self.skipped_packages.append(package)
+                        self._condition.notify_all()
+                    elif all(dep in self.built_packages
+                             for dep in dependencies):
+                        self.pending_packages.remove(package)
+                        return package
+                if self.pending_packages:
+                    self._condition.wait()
+            return None
+
+    def _release_package(self, package, succeeded, duration):
+        with self._condition:
+            self.durations[package.name] = duration
+            if succeeded:
+                self.built_packages.append(package)
+            else:
+                self.failed_packages.append(package)
+            self._condition.notify_all()
+
+    def report(self):
+        LOG.info("Parallel build results:")
+        for package in self.scheduled_packages:
+            if package in self.built_packages:
+                status = "built in %ds" % self.durations[package.name]
+            elif package in self.failed_packages:
+                status = "FAILED after %ds" % self.durations[package.name]
+            else:
+                status = "skipped"
+            LOG.info("  %s: %s" % (package.name, status))
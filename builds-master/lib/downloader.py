@@ -0,0 +1,391 @@
+# Copyright (C) IBM Corp. 2016.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from multiprocessing.pool import ThreadPool
+import collections
+import httplib
+import logging
+import os
+import socket
+import tempfile
+import threading
+import urllib2
+import urlparse
+
+from lib import config
+from lib import exception
+
+LOG = logging.getLogger(__name__)
+CHUNK_SIZE = 64 << 10
+DEFAULT_TIMEOUT = 60
+# maximum number of files downloaded at the same time
+DEFAULT_JOBS = 4
+# number of parallel byte range requests of a large file
+DEFAULT_SEGMENTS = 4
+MIN_SEGMENTED_SIZE = 16 << 20
+MAX_REDIRECTS = 5
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+_downloader = None
+_downloader_lock = threading.Lock()
+
+
+def get_downloader():
+    """
+    Get the downloader shared by all downloads, using the configured HTTP
+    proxy.
+    """
+    global _downloader
+    with _downloader_lock:
+        if _downloader is None:
+            CONF = config.get_config().CONF
+            _downloader = Downloader(
+                proxy=CONF.get('default').get('http_proxy'))
+        return _downloader
+
+
+def is_network_error(exc):
+    """
+    Check whether an error is a network failure after which a download
+    may be retried and resumed: a timeout, a connection reset or closed
+    by the server, or a response shorter than announced.
+    """
+    if isinstance(exc, urllib2.URLError) and not isinstance(
+            exc, urllib2.HTTPError):
+        exc = exc.reason
+    return isinstance(exc, (socket.error, httplib.IncompleteRead,
+                            httplib.BadStatusLine,
+                            exception.IncompleteDownloadError))
+
+
+class Response(object):
+    """
+    Response to an HTTP request, whose connection is returned to the
+    connections pool when the response is closed after being fully read.
+    """
+
+    def __init__(self, url, response, connection=None, pool=None,
+                 pool_key=None):
+        self.url = url
+        self._response = response
+        self._connection = connection
+        self._pool = pool
+        self._pool_key = pool_key
+
+    @property
+    def status(self):
+        return self._response.status
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def read(self, size=None):
+        return self._response.read(size)
+
+    def close(self):
+        if self._connection is None:
+            return
+        if self._response.isclosed() and not self._response.will_close:
+            self._pool.put(self._pool_key, self._connection)
+        else:
+            self._response.close()
+            self._connection.close()
+        self._connection = None
+
+
+class _UrllibResponse(object):
+    """
+    Response to a request of a URL scheme other than HTTP (e.g. FTP),
+    with the same interface as Response.
+    """
+
+    def __init__(self, url, response):
+        self.url = url
+        self._response = response
+        self.status = response.getcode() or httplib.OK
+
+    def getheader(self, name, default=None):
+        return self._response.info().getheader(name, default)
+
+    def read(self, size=None):
+        return self._response.read(size) if size else self._response.read()
+
+    def close(self):
+        self._response.close()
+
+
+class _ConnectionsPool(object):
+    """
+    Pool of idle keep-alive connections, per host.
+    """
+
+    def __init__(self, proxy=None, max_idle_connections=DEFAULT_JOBS):
+        self.proxy = urlparse.urlsplit(proxy) if proxy else None
+        self.max_idle_connections = max_idle_connections
+        self._idle_connections = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    def get(self, scheme, netloc, timeout):
+        """
+        Get an idle connection to a host, or a new one.
+
+        Returns:
+            (httplib.HTTPConnection, bool): connection and whether it was
+                used before
+        """
+        with self._lock:
+            idle_connections = self._idle_connections[(scheme, netloc)]
+            connection = idle_connections.pop() if idle_connections else None
+        if connection is None:
+            return (self._create(scheme, netloc, timeout), False)
+        connection.timeout = timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(timeout)
+        return (connection, True)
+
+    def put(self, key, connection):
+        with self._lock:
+            idle_connections = self._idle_connections[key]
+            if len(idle_connections) < self.max_idle_connections:
+                idle_connections.append(connection)
+                return
+        connection.close()
+
+    def _create(self, scheme, netloc, timeout):
+        connection_class = (httplib.HTTPSConnection if scheme == "https"
+                            else httplib.HTTPConnection)
+        if self.proxy is None:
+            return connection_class(netloc, timeout=timeout)
+        connection = connection_class(self.proxy.hostname,
+                                      self.proxy.port or 80, timeout=timeout)
+        if scheme == "https":
+            # HTTPS requests are tunneled through the proxy
+            connection.set_tunnel(netloc)
+        return connection
+
+    def get_request_target(self, url):
+        """
+        Get the request target of a URL: an absolute URL for requests
+        sent to a proxy, otherwise its path.
+        """
+        url_parts = urlparse.urlsplit(url)
+        if self.proxy is not None and url_parts.scheme == "http":
+            return url
+        return urlparse.urlunsplit(("", "") + url_parts[2:4] + ("",)) or "/"
+
+
+class Downloader(object):
+    """
+    HTTP downloader reusing connections to the same host, downloading
+    files concurrently and large files in parallel segments.
+    """
+
+    def __init__(self, proxy=None, jobs=DEFAULT_JOBS,
+                 segments=DEFAULT_SEGMENTS, timeout=DEFAULT_TIMEOUT):
+        self.jobs = jobs
+        self.segments = segments
+        self.timeout = timeout
+        self._pool = _ConnectionsPool(proxy, max_idle_connections=jobs)
+
+    def open(self, url, headers=None, timeout=None):
+        """
+        Send a GET request, following redirections.
+
+        Args:
+            url (str): URL
+            headers (dict): request headers
+            timeout (int): socket timeout, in seconds
+
+        Returns:
+            Response: response, which must be closed
+
+        Raises:
+            exception.DownloadError: if the response status is an error
+        """
+        headers = headers or {}
+        timeout = timeout or self.timeout
+        for _ in range(MAX_REDIRECTS + 1):
+            scheme = urlparse.urlsplit(url).scheme
+            if scheme not in ("http", "https"):
+                request = urllib2.Request(url, headers=headers)
+                return _UrllibResponse(
+                    url, urllib2.urlopen(request, timeout=timeout))
+
+            response = self._request(url, headers, timeout)
+            location = response.getheader("Location")
+            if response.status in REDIRECT_STATUSES and location:
+                response.read()
+                response.close()
+                url = urlparse.urljoin(url, location)
+                LOG.debug("Redirected to %s" % url)
+                continue
+            if response.status >= 400:
+                response.close()
+                raise exception.DownloadError(
+                    url=url, reason="HTTP status %d" % response.status,
+                    status=response.status)
+            return response
+        raise exception.DownloadError(url=url, reason="too many redirections")
+
+    def _request(self, url, headers, timeout):
+        url_parts = urlparse.urlsplit(url)
+        pool_key = (url_parts.scheme, url_parts.netloc)
+        target = self._pool.get_request_target(url)
+        while True:
+            connection, reused = self._pool.get(
+                url_parts.scheme, url_parts.netloc, timeout)
+            try:
+                connection.request("GET", target, headers=headers)
+                response = connection.getresponse()
+            except (httplib.HTTPException, socket.error) as exc:
+                connection.close()
+                # the server may have closed an idle connection
+                if reused and not isinstance(exc, socket.timeout):
+                    continue
+                raise
+            return Response(url, response, connection, self._pool, pool_key)
+
+    def download_file(self, url, file_path):
+        """
+        Download a file, streaming it to disk. Large files are downloaded
+        in parallel segments, if the server supports range requests.
+        """
+        LOG.info("Downloading %s" % url)
+        file_dir = os.path.dirname(os.path.abspath(file_path))
+        temp_file_descriptor, temp_file_path = tempfile.mkstemp(
+            dir=file_dir, prefix=".download-")
+        os.close(temp_file_descriptor)
+        try:
+            response = self.open(url)
+            try:
+                if not self.download_segments(response, temp_file_path):
+                    _write_response(response, temp_file_path)
+            finally:
+                response.close()
+            os.chmod(temp_file_path, 0644)
+            os.rename(temp_file_path, file_path)
+        except:
+            if os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+            raise
+
+    def download_files(self, urls_and_paths):
+        """
+        Download files concurrently.
+
+        Args:
+            urls_and_paths ([(str, str)]): URL and path of each file
+        """
+        if not urls_and_paths:
+            return
+        pool = ThreadPool(min(self.jobs, len(urls_and_paths)))
+        try:
+            pool.map(lambda url_and_path: self.download_file(*url_and_path),
+                     urls_and_paths)
+        finally:
+            pool.close()
+            pool.join()
+
+    def download_segments(self, response, file_path):
+        """
+        Download the content of a response in parallel byte range
+        segments, to a file, if the content is large and the server
+        supports range requests. The response is closed. If the server
+        does not honor a range request, the content is downloaded again
+        in a single request.
+
+        Returns:
+            bool: whether the content was downloaded
+        """
+        size = response.getheader("Content-Length")
+        if (response.status != httplib.OK or
+                response.getheader("Accept-Ranges") != "bytes" or
+                size is None or int(size) < MIN_SEGMENTED_SIZE or
+                self.segments < 2):
+            return False
+        size = int(size)
+        # the segments may only be requested if the file does not change
+        # meanwhile, which If-Range checks with strong validators only
+        etag = response.getheader("ETag")
+        if etag is not None and etag.startswith("W/"):
+            return False
+        validator = etag or response.getheader("Last-Modified")
+        if validator is None:
+            return False
+        response.close()
+
+        segment_size = -(-size // self.segments)
+        segments = [(start, min(start + segment_size, size) - 1)
+                    for start in range(0, size, segment_size)]
+        LOG.debug("Downloading %s in %d segments"
+                  % (response.url, len(segments)))
+        with open(file_path, "wb") as output_file:
+            output_file.truncate(size)
+
+        def _download_segment(segment):
+            """
+            Returns:
+                bool: whether the segment was downloaded, False if the
+                    server sent the whole file instead
+            """
+            start, end = segment
+            headers = {"Range": "bytes=%d-%d" % (start, end),
+                       "If-Range": validator}
+            segment_response = self.open(response.url, headers)
+            try:
+                if segment_response.status != httplib.PARTIAL_CONTENT:
+                    return False
+                with open(file_path, "r+b") as output_file:
+                    output_file.seek(start)
+                    remaining_size = end - start + 1
+                    while remaining_size:
+                        chunk = segment_response.read(
+                            min(CHUNK_SIZE, remaining_size))
+                        if not chunk:
+                            raise exception.IncompleteDownloadError(
+                                url=response.url,
+                                received=end - start + 1 - remaining_size,
+                                expected=end - start + 1)
+                        output_file.write(chunk)
+                        remaining_size -= len(chunk)
+            finally:
+                segment_response.close()
+            return True
+
+        pool = ThreadPool(len(segments))
+        try:
+            downloaded_segments = pool.map(_download_segment, segments)
+        finally:
+            pool.close()
+            pool.join()
+        if not all(downloaded_segments):
+            # the server ignores range requests, or the file changed
+            LOG.debug("Range request of %s not honored, downloading it in "
+                      "a single request" % response.url)
+            single_response = self.open(response.url)
+            try:
+                _write_response(single_response, file_path)
+            finally:
+                single_response.close()
+        return True
+
+
+def _write_response(response, file_path):
+    """
+    Write the content of a response to a file, streaming it in chunks.
+    """
+    with open(file_path, "wb") as output_file:
+        for chunk in iter(lambda: response.read(CHUNK_SIZE), b""):
+            output_file.write(chunk)
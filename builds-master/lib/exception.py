@@ -70,6 +70,27 @@ class PackageDescriptorError(PackageError):
     error_code = 18
 
 
+class PackageBuildError(PackageError):
+    DEFAULT_MESSAGE = "Failed to build packages: %(packages)s"
+    error_code = 19
+
+
+class PackageDependencyCycleError(PackageError):
+    DEFAULT_MESSAGE = "Packages dependencies have a cycle: %(cycle)s"
+    error_code = 20
+
+
+class PackageDownloadError(PackageError):
+    DEFAULT_MESSAGE = "Failed to download files of packages: %(packages)s"
+    error_code = 21
+
+
+class PackageDownloadChecksumError(PackageError):
+    DEFAULT_MESSAGE = ("Checksum of file downloaded from %(url)s does not "
+                       "match: expected %(expected)s, got %(actual)s")
+    error_code = 22
+
+
 class RepositoryError(BaseException):
     DEFAULT_MESSAGE = (
         "Failed to setup %(repo_name)s's repository at %(repo_path)s.")
@@ -85,6 +106,19 @@ class SubprocessError(BaseException):
     error_code = 32
 
 
+class DownloadError(BaseException):
+    DEFAULT_MESSAGE = "Failed to download %(url)s: %(reason)s"
+    # Subclass errors are in the form 0b0110xxx
+    error_code = 48
+
+
+class IncompleteDownloadError(DownloadError):
+    DEFAULT_MESSAGE = (
+        "Download of %(url)s interrupted after %(received)s of "
+        "%(expected)s bytes")
+    error_code = 49
+
+
 class TimeoutError(BaseException):
     DEFAULT_MESSAGE = (
         "Timeout failure on %(func_name)s after %(num_attempts)s attempts. "
@@ -0,0 +1,246 @@
+# Copyright (C) IBM Corp. 2016.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import cPickle
+import logging
+import os
+
+import yaml
+
+from lib import utils
+
+LOG = logging.getLogger(__name__)
+METADATA_INDEX_DIR_NAME = "metadata-index"
+# incremented whenever the index format changes
+INDEX_FORMAT_VERSION = 3
+
+_index = None
+
+
+def get_index():
+    """
+    Get the metadata index of the packages metadata repository, if it
+    was loaded.
+
+    Returns:
+        MetadataIndex: index, or None
+    """
+    return _index
+
+
+def load_index(versions_repo, packages_dirs, cache_dir):
+    """
+    Load the metadata index of the packages metadata repository HEAD
+    commit, building it if it is not cached yet. The index is not used
+    if the repository working tree has uncommitted changes, as it would
+    not reflect them.
+
+    Args:
+        versions_repo (GitRepository): packages metadata git repository
+        packages_dirs ([str]): directories containing packages, relative
+            to the repository, in lookup order
+        cache_dir (str): directory where indexes are stored
+
+    Returns:
+        MetadataIndex: index, or None
+    """
+    global _index
+    _index = None
+    if versions_repo.is_dirty(untracked_files=True):
+        LOG.info("Versions repository has uncommitted changes, not using "
+                 "its metadata index")
+        return None
+
+    commit_id = versions_repo.head.commit.hexsha
+    index_file_path = os.path.join(
+        cache_dir, METADATA_INDEX_DIR_NAME,
+        "%s-%d.pickle" % (commit_id, INDEX_FORMAT_VERSION))
+    repo_dir = versions_repo.working_tree_dir
+    if os.path.isfile(index_file_path):
+        LOG.debug("Loading metadata index %s" % index_file_path)
+        with open(index_file_path, "rb") as index_file:
+            _index = MetadataIndex(repo_dir, cPickle.load(index_file))
+        return _index
+
+    LOG.info("Building metadata index of versions repository commit %s"
+             % commit_id)
+    _index = MetadataIndex.build(repo_dir, packages_dirs)
+    try:
+        utils.create_directory(os.path.dirname(index_file_path))
+        utils.write_file_atomically(index_file_path, cPickle.dumps(
+            _index.packages, cPickle.HIGHEST_PROTOCOL))
+    except EnvironmentError as exc:
+        # the index is rebuilt next time
+        LOG.warning("Failed to save metadata index %s: %s"
+                    % (index_file_path, exc))
+    return _index
+
+
+class PackageMetadata(object):
+    """
+    Metadata of a package in the index: its YAML descriptor data and the
+    files of its directory.
+    """
+
+    def __init__(self, repo_dir, rel_package_dir, discoverable, files,
+                 data_pickle):
+        self.package_dir = os.path.join(repo_dir, rel_package_dir)
+        self.package_file = os.path.join(
+            self.package_dir, os.path.basename(rel_package_dir) + ".yaml")
+        self.discoverable = discoverable
+        self._files = files
+        self._data_pickle = data_pickle
+
+    @property
+    def data(self):
+        """
+        Get the YAML descriptor data, as a new object which the caller
+        may modify, or None if the YAML descriptor failed to parse.
+        """
+        if self._data_pickle is None:
+            return None
+        return cPickle.loads(self._data_pickle)
+
+    def isfile(self, path):
+        """
+        Check whether a path is a file, as os.path.isfile does.
+        """
+        rel_path = self._get_rel_path(path)
+        if rel_path is None:
+            return os.path.isfile(path)
+        return self._files.get(rel_path) == "f"
+
+    def isdir(self, path):
+        """
+        Check whether a path is a directory, as os.path.isdir does.
+        """
+        rel_path = self._get_rel_path(path)
+        if rel_path is None:
+            return os.path.isdir(path)
+        return self._files.get(rel_path) == "d"
+
+    def _get_rel_path(self, path):
+        """
+        Get the path relative to the package directory, or None if it is
+        not in the package directory.
+        """
+        rel_path = os.path.relpath(path, self.package_dir)
+        if rel_path == os.pardir or rel_path.startswith(os.pardir + os.sep):
+            return None
+        return os.path.normpath(rel_path)
+
+
+class MetadataIndex(object):
+    """
+    Index of the packages of a packages metadata repository commit,
+    holding their already parsed YAML descriptors and the listing of
+    their directories, so that packages are loaded without parsing YAML
+    files or searching the file system.
+    """
+
+    def __init__(self, repo_dir, packages):
+        """
+        Args:
+            repo_dir (str): packages metadata repository directory
+            packages (dict): relative package directory, whether it is
+                discoverable, file types by relative path and pickled
+                YAML data (None if it failed to parse), by package name
+        """
+        self.repo_dir = repo_dir
+        self.packages = packages
+
+    @classmethod
+    def build(cls, repo_dir, packages_dirs):
+        """
+        Build the index of the packages in the packages directories of a
+        repository. When a package is present in more than one of them,
+        the first one is used.
+        """
+        packages = {}
+        for rel_packages_dir in packages_dirs:
+            packages_dir = os.path.join(repo_dir, rel_packages_dir)
+            if not os.path.isdir(packages_dir):
+                continue
+            for name in sorted(os.listdir(packages_dir)):
+                package_dir = os.path.join(packages_dir, name)
+                package_file = os.path.join(package_dir, name + ".yaml")
+                if name in packages or not os.path.isfile(package_file):
+                    continue
+                try:
+                    with open(package_file) as package_file_:
+                        data_pickle = cPickle.dumps(
+                            yaml.load(package_file_),
+                            cPickle.HIGHEST_PROTOCOL)
+                except yaml.YAMLError:
+                    # the package loads its YAML descriptor again,
+                    # reporting the error
+                    LOG.warning("Failed to parse %s, not indexing its data"
+                                % package_file)
+                    data_pickle = None
+                packages[name] = (
+                    os.path.join(rel_packages_dir, name),
+                    rel_packages_dir == "", _list_files(package_dir),
+                    data_pickle)
+        return cls(repo_dir, packages)
+
+    def get_package(self, name):
+        """
+        Get the metadata of a package.
+
+        Returns:
+            PackageMetadata: package metadata, or None if the package is
+                not in the index
+        """
+        if name not in self.packages:
+            return None
+        return PackageMetadata(self.repo_dir, *self.packages[name])
+
+    def get_discoverable_packages(self):
+        """
+        Get the names of the packages at the root of the repository.
+        """
+        return [name for name, package in self.packages.items()
+                if package[1]]
+
+
+def _list_files(directory):
+    """
+    List the files and directories under a directory, following symbolic
+    links to directories, as os.path.isfile and os.path.isdir do. Links
+    to a directory containing them are not followed, to avoid loops.
+
+    Returns:
+        dict: "f" for files and "d" for directories, by relative path
+    """
+    files = {os.curdir: "d"}
+    for root, dirs, file_names in os.walk(directory, followlinks=True):
+        real_root = os.path.realpath(root)
+        rel_root = os.path.relpath(root, directory)
+        for name in dirs + file_names:
+            path = os.path.join(root, name)
+            rel_path = os.path.normpath(os.path.join(rel_root, name))
+            if os.path.isdir(path):
+                files[rel_path] = "d"
+            elif os.path.isfile(path):
+                files[rel_path] = "f"
+        dirs[:] = [name for name in dirs
+                   if not _is_same_or_parent_dir(
+                       os.path.realpath(os.path.join(root, name)), real_root)]
+    return files
+
+
+def _is_same_or_parent_dir(dir_path, other_dir_path):
+    return (other_dir_path == dir_path or
+            other_dir_path.startswith(dir_path.rstrip(os.sep) + os.sep))
@@ -16,9 +16,15 @@ from functools import partial
 
 
 import datetime
+import errno
+import fcntl
+import hashlib
 import logging
 import os
+import re
 import shutil
+import threading
+import urllib2
 
 from lib import config
 from lib import build_system
@@ -29,45 +35,226 @@ from lib import utils
 CONF = config.get_config().CONF
 LOG = logging.getLogger(__name__)
 MOCK_CHROOT_BUILD_DIR = "/builddir/build/SOURCES"
+MOCK_ROOT_CACHE_DIR_NAME = "mock_roots"
+
+_root_cache_dirs = {}
+_root_cache_dirs_lock = threading.Lock()
+
+
+def _get_enabled_repos_base_urls(config_content):
+    """
+    Get the base URLs of the enabled repositories of the yum
+    configuration embedded in a mock configuration. Repositories are
+    enabled unless they have enabled=0.
+    """
+    repos = []
+    options = None
+    for line in config_content.splitlines():
+        section_match = re.match(r'^\s*\[([^\]]+)\]\s*$', line)
+        if section_match:
+            options = {}
+            repos.append(options)
+            continue
+        option_match = re.match(r'^\s*(\w+)\s*=\s*(.*?)\s*$', line)
+        if option_match and options is not None:
+            options[option_match.group(1).lower()] = option_match.group(2)
+
+    return [options["baseurl"].split()[0] for options in repos
+            if options.get("baseurl") and options.get(
+                "enabled", "1").lower() not in ("0", "false", "no")]
+
+
+def _get_upstream_metadata_digest(config_content):
+    """
+    Get a digest of the metadata of the enabled repositories with a base
+    URL in the mock configuration. Repositories configured with mirror lists are
+    not considered, as different mirrors have different metadata files.
+
+    Returns:
+        str: metadata digest or None if any repository metadata could
+            not be read
+    """
+    digest = hashlib.sha256()
+    for base_url in _get_enabled_repos_base_urls(config_content):
+        metadata_url = base_url.rstrip("/") + "/repodata/repomd.xml"
+        try:
+            response = urllib2.urlopen(metadata_url, timeout=30)
+            digest.update(response.read())
+        except (urllib2.URLError, IOError):
+            LOG.warning("Failed to read repository metadata from %s"
+                        % metadata_url)
+            return None
+    return digest.hexdigest()
+
+
+def get_root_cache_dir(config_file):
+    """
+    Get the directory where mock stores the snapshot of a chroot, created
+    after its initialization, so that following initializations just
+    restore it.
+
+    The directory is unique to the configuration file content, which
+    includes the packages installed in the chroot, and to the metadata of
+    the upstream repositories, so that the snapshot is refreshed when any
+    of them changes. If the metadata can not be read, the newest snapshot
+    of the configuration is reused.
+    """
+    with _root_cache_dirs_lock:
+        if config_file in _root_cache_dirs:
+            return _root_cache_dirs[config_file]
+
+        with open(config_file) as f:
+            config_content = f.read()
+        config_cache_dir = os.path.join(
+            CONF.get('default').get('cache_path'), MOCK_ROOT_CACHE_DIR_NAME,
+            hashlib.sha256(config_content).hexdigest())
+
+        metadata_digest = _get_upstream_metadata_digest(config_content)
+        if metadata_digest is None and os.path.isdir(config_cache_dir):
+            snapshots_dirs = [
+                os.path.join(config_cache_dir, dir_name)
+                for dir_name in os.listdir(config_cache_dir)
+                if os.path.isdir(os.path.join(config_cache_dir, dir_name))]
+            if snapshots_dirs:
+                root_cache_dir = max(snapshots_dirs, key=os.path.getmtime)
+                LOG.info("Reusing newest chroot snapshot %s"
+                         % root_cache_dir)
+                _root_cache_dirs[config_file] = root_cache_dir
+                return root_cache_dir
+
+        root_cache_dir = os.path.join(
+            config_cache_dir, metadata_digest or "unknown-metadata")
+        utils.create_directory(root_cache_dir)
+        _root_cache_dirs[config_file] = root_cache_dir
+        return root_cache_dir
+
+
+def _lock_root_cache(root_cache_dir, exclusive=False):
+    """
+    Lock a chroot snapshot. Runs using a snapshot hold a shared lock, so
+    that it is only removed when no run uses it.
+
+    flock is used, instead of lockf, since its locks belong to the open
+    file and not to the process, so that they also exclude the other
+    mock instances of the same process.
+
+    Returns:
+        file: lock file, which releases the lock when closed, or None if
+            the exclusive lock is held by another run
+    """
+    lock_file = open(root_cache_dir + ".lock", "a")
+    try:
+        if exclusive:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            fcntl.flock(lock_file, fcntl.LOCK_SH)
+    except IOError as exc:
+        lock_file.close()
+        if exclusive and exc.errno in (errno.EAGAIN, errno.EACCES):
+            return None
+        raise
+    return lock_file
+
+
+def _remove_outdated_root_caches(root_cache_dir):
+    """
+    Remove chroot snapshots of the same configuration as the snapshot in
+    [root_cache_dir], created for older upstream repositories metadata.
+    Snapshots used by other runs are kept.
+    """
+    config_cache_dir = os.path.dirname(root_cache_dir)
+    for dir_name in os.listdir(config_cache_dir):
+        dir_path = os.path.join(config_cache_dir, dir_name)
+        if dir_path == root_cache_dir or not os.path.isdir(dir_path):
+            continue
+        lock_file = _lock_root_cache(dir_path, exclusive=True)
+        if lock_file is None:
+            LOG.debug("Keeping outdated chroot snapshot %s, in use by "
+                      "another run" % dir_path)
+            continue
+        try:
+            LOG.debug("Removing outdated chroot snapshot %s" % dir_path)
+            shutil.rmtree(dir_path, ignore_errors=True)
+            os.remove(dir_path + ".lock")
+        finally:
+            lock_file.close()
 
 
 class Mock(build_system.PackageBuilder):
-    def __init__(self, config_file):
+    def __init__(self, config_file, unique_extension=None):
         super(Mock, self).__init__()
         binary_file = CONF.get('default').get('mock_binary')
         extra_args = CONF.get('default').get('mock_args')
+        self.config_file = config_file
         self.result_dir = CONF.get('default').get('result_dir')
         self.build_dir = None
         self.archive = None
         self.timestamp = datetime.datetime.now().isoformat()
-        self.common_mock_args = (
+        # directory of the packages build directories and mock logs
+        self.work_dir = os.path.join(os.getcwd(), 'build', self.timestamp)
+        self.binary_file = binary_file
+        self.extra_args = extra_args
+        self.unique_extension = unique_extension or self.timestamp
+        # resolved on first use, since it reads the upstream repositories
+        # metadata, which is not needed if nothing is built
+        self.root_cache_dir = None
+        self._root_cache_lock_file = None
+
+    @property
+    def common_mock_args(self):
+        if self.root_cache_dir is None:
+            self.root_cache_dir = get_root_cache_dir(self.config_file)
+        return (
             "%(binary_file)s -r %(config_file)s %(extra_args)s "
+            "--enable-plugin=root_cache "
+            "--plugin-option=root_cache:dir=%(root_cache_dir)s "
             "--uniqueext %(suffix)s" % dict(
-                binary_file=binary_file, config_file=config_file,
-                extra_args=extra_args, suffix=self.timestamp))
+                binary_file=self.binary_file, config_file=self.config_file,
+                extra_args=self.extra_args,
+                root_cache_dir=self.root_cache_dir,
+                suffix=self.unique_extension))
 
     def initialize(self):
         """
         Initializes the configured chroot by installing the essential
         packages. This setup is common for all packages that are built
         and needs to be done only once.
+        If there is a snapshot of a chroot initialized with the same
+        configuration, mock restores it instead.
+        """
+        utils.create_directory(self.work_dir)
+        if self.root_cache_dir is None:
+            self.root_cache_dir = get_root_cache_dir(self.config_file)
+        # held while this instance exists, keeping the snapshot from
+        # being removed by other runs
+        if self._root_cache_lock_file is None:
+            self._root_cache_lock_file = _lock_root_cache(self.root_cache_dir)
+        self._run_mock_command(
+            " --init", os.path.join(self.work_dir, "mock-init.log"))
+        _remove_outdated_root_caches(self.root_cache_dir)
+
+    def _run_mock_command(self, mock_args, log_file_path):
+        """
+        Run mock with the common arguments and [mock_args], writing its
+        output to [log_file_path].
         """
-        cmd = self.common_mock_args + " --init"
-        utils.run_command(cmd)
+        utils.run_command(self.common_mock_args + mock_args,
+                          log_file_path=log_file_path, keep_output=False)
 
     def build(self, package):
         LOG.info("%s: Starting build process" % package.name)
         self._build_srpm(package)
         self._install_external_dependencies(package)
-        cmd = (self.common_mock_args + " --rebuild %s --no-clean --resultdir=%s"
-               % (self.build_dir + "/*.rpm", self.build_dir))
+        mock_args = (" --rebuild %s --no-clean --resultdir=%s"
+                     % (self.build_dir + "/*.rpm", self.build_dir))
 
         if package.rpmmacro:
-            cmd = cmd + " --macro-file=%s" % package.rpmmacro
+            mock_args = mock_args + " --macro-file=%s" % package.rpmmacro
 
         LOG.info("%s: Building RPM" % package.name)
         try:
-            utils.run_command(cmd)
+            self._run_mock_command(
+                mock_args, os.path.join(self.build_dir, "mock-rebuild.log"))
 
             # On success save rpms and destroy build directory unless told
             # otherwise.
@@ -85,10 +272,11 @@ class Mock(build_system.PackageBuilder):
 
     def _build_srpm(self, package):
         LOG.info("%s: Building SRPM" % package.name)
-        cmd = (self.common_mock_args +
-               " --buildsrpm --no-clean --spec %s --sources %s --resultdir=%s"
-               % (package.spec_file.path, self.archive, self.build_dir))
-        utils.run_command(cmd)
+        mock_args = (
+            " --buildsrpm --no-clean --spec %s --sources %s --resultdir=%s"
+            % (package.spec_file.path, self.archive, self.build_dir))
+        self._run_mock_command(
+            mock_args, os.path.join(self.build_dir, "mock-buildsrpm.log"))
 
     def prepare_sources(self, package):
         LOG.info("%s: Preparing source files." % package.name)
@@ -122,22 +310,21 @@ class Mock(build_system.PackageBuilder):
             shutil.copy(file_path, self.archive)
 
     def clean(self):
-        utils.run_command(self.common_mock_args + " --clean")
+        self._run_mock_command(
+            " --clean", os.path.join(self.work_dir, "mock-clean.log"))
 
     def _install_external_dependencies(self, package):
         if package.build_dependencies:
-            cmd = self.common_mock_args
             install = " --install"
             for dep in package.build_dependencies:
                 install = " ".join([install, " ".join(dep.result_packages)])
 
-            cmd = cmd + install
             LOG.info("%s: Installing dependencies on chroot" % package.name)
-            utils.run_command(cmd)
+            self._run_mock_command(
+                install, os.path.join(self.build_dir, "mock-install.log"))
 
     def _create_build_directory(self, package):
-        self.build_dir = os.path.join(
-            os.getcwd(), 'build', self.timestamp, package.name)
+        self.build_dir = os.path.join(self.work_dir, package.name)
         os.makedirs(self.build_dir)
         os.chmod(self.build_dir, 0777)
 
@@ -148,7 +335,7 @@ class Mock(build_system.PackageBuilder):
         if not os.path.exists(self.result_dir):
             LOG.info("Creating directory to store RPM at %s " %
                      self.result_dir)
-            os.makedirs(self.result_dir)
+            utils.create_directory(self.result_dir)
             os.chmod(self.result_dir, 0777)
 
         LOG.info("%s: Saving RPMs at %s" % (package.name, self.result_dir))
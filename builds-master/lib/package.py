@@ -18,17 +18,22 @@ from functools import total_ordering
 import fcntl
 import logging
 import os
-import urllib2
 import yaml
 
 from lib import config
+from lib import downloader
 from lib import exception
+from lib import metadata_index
 from lib import package_source
 from lib import repository
+from lib import scheduler
 from lib import utils
 
 CONF = config.get_config().CONF
 LOG = logging.getLogger(__name__)
+# Dependencies packages may be present in those directories in older
+# versions of package metadata. This keeps compatibility.
+OLD_DEPENDENCIES_DIRS = ["build_dependencies", "dependencies"]
 
 
 @total_ordering
@@ -65,9 +70,14 @@ class Package(object):
         self.lock_file_path = os.path.join(
             locks_dir, self.name + ".lock")
 
-        # Dependencies packages may be present in those directories in older
-        # versions of package metadata. This keeps compatibility.
-        OLD_DEPENDENCIES_DIRS = ["build_dependencies", "dependencies"]
+        index = metadata_index.get_index()
+        self.metadata = index and index.get_package(self.name)
+        if self.metadata is not None:
+            self.package_dir = self.metadata.package_dir
+            self.package_file = self.metadata.package_file
+            self._load()
+            return
+
         PACKAGES_DIRS = [""] + OLD_DEPENDENCIES_DIRS
         versions_repo_url = CONF.get('default').get('build_versions_repository_url')
         versions_repo_name = os.path.basename(os.path.splitext(versions_repo_url)[0])
@@ -99,25 +109,66 @@ class Package(object):
         return self.name
 
 
-    def download_files(self, recurse=True):
+    def download_files(self, recurse=True, working_tree=True,
+                       build_files=True):
         """
         Download package source code and build files.
         Optionally, do the same for its dependencies, recursively.
+        If not [working_tree], git sources are not checked out, as they
+        are archived straight from their repositories. If not
+        [build_files], only the source code is downloaded, e.g. when
+        build files were already downloaded.
+        """
+        if recurse:
+            # shared dependencies are downloaded only once
+            for package in scheduler.collect_packages([self]):
+                package.download_files(recurse=False,
+                                       working_tree=working_tree,
+                                       build_files=build_files)
+            return
+
+        for _, _, _, download_f in self.get_download_tasks(
+                working_tree, build_files):
+            download_f()
+
+    def get_download_tasks(self, working_tree=True, build_files=True):
+        """
+        Get the tasks which download the package source code and,
+        optionally, build files, allowing them to run concurrently with
+        other packages tasks.
+
+        Returns:
+            [(str, str, dict, function)]: tuples containing the local path
+                written by the task, the remote host name, the source
+                dict downloaded (if any) and the task function, which
+                takes no arguments
         """
-        # Download all package sources
         repositories_path = CONF.get('default').get('repositories_path')
-        download_f = partial(package_source.download, directory=repositories_path, local_copy_subdir_name=self.name)
-        self.sources = map(download_f, self.sources)
+        tasks = []
+        for source in self.sources:
+            download_path = package_source.get_download_path(
+                source, repositories_path, self.name)
+            download_f = partial(
+                package_source.download, source, directory=repositories_path,
+                local_copy_subdir_name=self.name, working_tree=working_tree)
+            tasks.append((download_path, package_source.get_host(source),
+                          source, download_f))
 
         # This is kept for backwards compatibility with older
         # 'versions' repositories.
         if self.clone_url:
-            self._download_source_code()
+            download_path = package_source.get_download_path(
+                {"git": {"src": self.clone_url}}, repositories_path)
+            host = package_source.get_host({"git": {"src": self.clone_url}})
+            tasks.append((download_path, host, None,
+                          self._download_source_code))
 
-        self._download_build_files()
-        if recurse:
-            for dep in (self.install_dependencies + self.build_dependencies):
-                dep.download_files()
+        if build_files and self.download_build_files:
+            host = package_source.get_host(
+                {"url": {"src": self.download_build_files[0]}})
+            tasks.append((self.build_files, host, None,
+                          self._download_build_files))
+        return tasks
 
     def _download_source_code(self):
         LOG.info("%s: Downloading source code from '%s'." %
@@ -130,12 +181,16 @@ class Package(object):
         """
         Read yaml file describing this package.
         """
-        try:
-            with open(self.package_file, 'r') as package_file:
-                self.package_data = yaml.load(package_file).get('Package')
-        except IOError:
-            raise exception.PackageDescriptorError(
-                "Failed to open %s's YAML descriptor" % self.name)
+        data = self.metadata.data if self.metadata is not None else None
+        if data is not None:
+            self.package_data = data.get('Package')
+        else:
+            try:
+                with open(self.package_file, 'r') as package_file:
+                    self.package_data = yaml.load(package_file).get('Package')
+            except IOError:
+                raise exception.PackageDescriptorError(
+                    "Failed to open %s's YAML descriptor" % self.name)
 
         self.name = os.path.splitext(os.path.basename(self.package_file))[0]
         self.sources = self.package_data.get('sources', [])
@@ -174,6 +229,24 @@ class Package(object):
             # Old sources format is used, it's better to enable locking
             self.locking_enabled = True
 
+    def _isfile(self, path):
+        """
+        Check whether a path is a file, using the metadata index if the
+        package is in it.
+        """
+        if self.metadata is not None:
+            return self.metadata.isfile(path)
+        return os.path.isfile(path)
+
+    def _isdir(self, path):
+        """
+        Check whether a path is a directory, using the metadata index if
+        the package is in it.
+        """
+        if self.metadata is not None:
+            return self.metadata.isdir(path)
+        return os.path.isdir(path)
+
     def _setup_repository(self, dest=None, branch=None):
         self.repository = repository.get_git_repository(
             self.clone_url, dest)
@@ -190,12 +263,9 @@ class Package(object):
         return os.path.join(build_dir, self.expects_source)
 
     def _download_build_files(self):
-        for url in self.download_build_files:
-            f = urllib2.urlopen(url)
-            data = f.read()
-            filename = os.path.join(self.build_files, url.split('/')[-1])
-            with open(filename, "wb") as file_data:
-                file_data.write(data)
+        downloader.get_downloader().download_files([
+            (url, os.path.join(self.build_files, url.split('/')[-1]))
+            for url in self.download_build_files])
 
     def lock(self):
         """
@@ -1,25 +1,62 @@
+import fcntl
+import hashlib
+import logging
 import os
+import re
 import shutil
-import socket
-import urllib2
+import tempfile
+import urlparse
+import yaml
 
 
+from lib import archiver
 from lib import config
+from lib import downloader
 from lib import exception
 from lib import repository
 from lib import utils
 
+LOG = logging.getLogger(__name__)
+DOWNLOADS_CACHE_DIR_NAME = "downloads"
+ARCHIVES_CACHE_DIR_NAME = "archives"
+DOWNLOAD_CHUNK_SIZE = 64 << 10
+
+
+def _is_timeout_error(exc):
+    if not isinstance(exc, exception.SubprocessError):
+        return False
+    return ('timed out' in exc.stdout or 'timed out' in exc.stderr)
+
+
+def _run_remote_command(command, **kwargs):
+    """
+    Run a command which accesses a remote repository, retrying it with
+    longer timeouts when it times out. [command] is formatted with the
+    timeout value, in seconds, as the 'timeout' key.
+
+    Returns:
+        str: command output
+    """
+    def _run_command(timeout):
+        return utils.run_command(command.format(timeout=timeout), **kwargs)
+
+    return utils.retry_on_timeout(_run_command,
+                                  is_timeout_error_f=_is_timeout_error,
+                                  initial_timeout=60)
+
 
 def _hg_download(source, directory):
     """
-    Clones a mercurial [source] to [directory] and returns a source dict.
+    Updates the mirror of a mercurial [source] in [directory], cloning it
+    if needed, and returns a source dict with the ID of the commit to be
+    archived. The mirror has no working copy.
     """
-    CONF = config.get_config().CONF
-    proxy = CONF.get('default').get('http_proxy')
     hg_source = source['hg']
+    if 'revision' in hg_source:
+        # already downloaded
+        return source
     repo_name = os.path.basename(hg_source['src'])
     dest = os.path.join(directory, repo_name)
-    command = 'hg '
 
     commit_id = hg_source.get('commit_id')
     branch = hg_source.get('branch')
@@ -28,34 +65,67 @@ def _hg_download(source, directory):
         raise ValueError('invalid hg source dict: missing both `commit_id` '
                          'and `branch`')
 
-    command += 'clone "{}" -r "{}" "{}" '.format(hg_source['src'],
-                                                hg_source['branch'],
-                                                dest)
-    if proxy:
-        command += '--config http_proxy.host="{}" '.format(proxy)
-    command += "--ssh '/usr/bin/env ssh -o ConnectTimeout={}'"
+    revision = None
+    is_cloned = os.path.isdir(os.path.join(dest, ".hg"))
+    if is_cloned and commit_id and re.match(r"^[0-9a-f]{40}$", commit_id):
+        # full commit IDs can not change, skip pulling if already present
+        revision = _get_hg_revision(dest, commit_id)
+
+    if revision is None:
+        options = _get_hg_options()
+        if is_cloned:
+            LOG.info("Pulling changes from %s into %s"
+                     % (hg_source['src'], dest))
+            _run_remote_command('hg pull %s "%s"' % (
+                options, hg_source['src']), cwd=dest)
+        else:
+            LOG.info("Cloning mercurial repository from %s into %s"
+                     % (hg_source['src'], dest))
+            _run_remote_command('hg clone -U %s "%s" "%s"' % (
+                options, hg_source['src'], dest))
+        revision = _get_hg_revision(dest, commit_id or branch)
+        if revision is None:
+            raise exception.RepositoryError(
+                message="Could not find revision %s at %s repository"
+                % (commit_id or branch, repo_name))
 
-    def _clone_repository(timeout):
-        cmd = command.format(timeout)
-        utils.run_command(cmd)
+    source['hg']['dest'] = dest
+    source['hg']['revision'] = revision
+    return source
 
-    def _is_timeout_error(exc):
-        if not isinstance(exc, exception.SubprocessError):
-            return False
-        return ('timed out' in exc.stdout or 'timed out' in exc.stderr)
 
-    utils.retry_on_timeout(_clone_repository,
-                           is_timeout_error_f=_is_timeout_error,
-                           initial_timeout=60)
+def _get_hg_options():
+    """
+    Get the hg command options setting up the configured HTTP proxy and
+    the ssh connection timeout, to be formatted with the 'timeout' key.
+    """
+    CONF = config.get_config().CONF
+    proxy = CONF.get('default').get('http_proxy')
+
+    options = ''
+    if proxy:
+        options += '--config http_proxy.host="{}" '.format(proxy)
+    options += "--ssh '/usr/bin/env ssh -o ConnectTimeout={timeout}'"
+    return options
 
-    source['hg']['dest'] = dest
-    return source
+
+def _get_hg_revision(dest, revision):
+    """
+    Get the full ID of a mercurial commit, given any revision identifier,
+    or None if it is not found.
+    """
+    try:
+        return utils.run_command(
+            'hg id -i --debug -r "%s"' % revision, cwd=dest).strip()
+    except exception.SubprocessError:
+        return None
 
 
-def _git_download(source, directory):
+def _git_download(source, directory, working_tree=True):
     """
     Clones a git [source] to [directory] and returns a dict with a key pointing
-    to the cloned repository.
+    to the cloned repository and the ID of the commit to be archived.
+    If not [working_tree], the commit is not checked out.
     """
     git_source = source['git']
     commit_id = git_source.get('commit_id')
@@ -66,21 +136,49 @@ def _git_download(source, directory):
                          'and `branch`')
 
     def _download_repository():
-        return repository.get_git_repository(git_source['src'], directory)
+        return repository.get_git_repository(
+            git_source['src'], directory,
+            clone_strategy=git_source.get(
+                'clone_strategy', repository.DEFAULT_CLONE_STRATEGY),
+            family=git_source.get('family'))
 
     repo = utils.retry_on_error(_download_repository,
                                 error=exception.RepositoryError)
-    repo.checkout(commit_id or branch)
+    commit = repo.checkout(commit_id or branch, working_tree=working_tree)
     source['git']['repo'] = repo
+    source['git']['revision'] = commit.hexsha
     return source
 
 
+def _get_svn_options():
+    """
+    Get the svn command options setting up the configured HTTP proxy and
+    the timeout, to be formatted with the 'timeout' key.
+    """
+    CONF = config.get_config().CONF
+    proxy = CONF.get('default').get('http_proxy')
+
+    options = ["servers:global:http-timeout={timeout}"]
+    if proxy:
+        url = urlparse.urlparse(proxy)
+        host = url.scheme + '://' + url.hostname
+        port = url.port
+        options += ["servers:global:http-proxy-host='%s'" % host,
+                    "servers:global:http-proxy-port='%s'" % port]
+
+    return ' '.join('--config-option ' + option for option in options)
+
+
 def _svn_download(source, directory):
     """
-    Checkout a Subversion [source] to [directory] and returns a dict with a key
-    pointing to the cloned repository
+    Resolves the revision of a Subversion [source] and returns a source
+    dict with it. Nothing is downloaded to [directory]: the revision is
+    exported when archiving the source.
     """
     svn_source = source['svn']
+    if 'revision' in svn_source:
+        # already resolved
+        return source
     commit_id = svn_source.get('commit_id')
     branch = svn_source.get('branch')
 
@@ -88,18 +186,15 @@ def _svn_download(source, directory):
         raise ValueError('invalid subversion source dict: missing both `commit_id` '
                          'and `branch`')
 
-    def _download_repository():
-        return repository.get_svn_repository(svn_source['src'], directory)
-    repo = utils.retry_on_error(_download_repository,
-                                error=exception.RepositoryError)
-
-    def _checkout_repository():
-        repo.checkout(commit_id or branch)
-    utils.retry_on_error(_checkout_repository,
-                         error=exception.RepositoryError)
+    output = _run_remote_command('svn info --xml %s "%s@%s"' % (
+        _get_svn_options(), svn_source['src'], commit_id or branch))
+    match = re.search(r'revision="(\d+)"', output)
+    if match is None:
+        raise exception.RepositoryError(
+            message="Could not find revision %s at %s repository"
+            % (commit_id or branch, svn_source['src']))
 
-    source['svn']['repo'] = repo
-    source['svn']['dest'] = directory
+    source['svn']['revision'] = match.group(1)
     return source
 
 def _url_download(source, directory):
@@ -107,32 +202,186 @@ def _url_download(source, directory):
     Downloads a file from URL [source] to [directory] and returns a source
     dict.
     """
-    file_name = os.path.basename(source['url']['src'])
-    dest = os.path.join(directory, file_name)
+    if os.path.isfile(source['url'].get('dest', '')):
+        # already downloaded and not archived yet
+        return source
+
+    url = source['url']['src']
+    dest = os.path.join(directory, os.path.basename(url))
+    cached_file_path = get_cached_url_file(url, source['url'].get('checksum'))
+    utils.link_or_copy(cached_file_path, dest)
+    source['url']['dest'] = dest
+    return source
 
-    CHUNK_SIZE = 16 << 1024
 
-    def _open_url(timeout):
-        return urllib2.urlopen(source['url']['src'], timeout=timeout)
+def _parse_checksum(checksum):
+    """
+    Parse a checksum in the form "<algorithm>:<hex digest>", e.g.
+    "sha256:9f86d0...".
 
-    response = utils.retry_on_timeout(_open_url,
-                                      lambda exc: isinstance(exc,
-                                                             socket.timeout),
-                                      initial_timeout=10)
+    Returns:
+        (str, str): hash algorithm and hex digest
+    """
+    algorithm, _, hex_digest = checksum.partition(":")
+    if not hex_digest or algorithm not in hashlib.algorithms:
+        raise exception.PackageDescriptorError(
+            "Invalid checksum '%s', expected '<algorithm>:<hex digest>' "
+            "with one of the algorithms %s"
+            % (checksum, ", ".join(hashlib.algorithms)))
+    return (algorithm, hex_digest.lower())
 
-    with open(dest, 'wb') as f:
-        while True:
-            chunk = response.read(CHUNK_SIZE)
-            if not chunk:
-                break
-            f.write(chunk)
-    source['url']['dest'] = dest
-    return source
 
+def get_cached_url_file(url, checksum=None):
+    """
+    Get the path of the file downloaded from [url] to the downloads
+    cache, downloading it if the cache has no valid copy.
+
+    A cached file is valid if it matches [checksum] or, if there is no
+    checksum, if the server reports it was not modified since it was
+    downloaded.
+
+    Args:
+        url (str): file URL
+        checksum (str): expected checksum, in the form
+            "<algorithm>:<hex digest>"
 
-def download(source, directory='/tmp', local_copy_subdir_name=None):
+    Returns:
+        str: path of the cached file
+    """
+    CONF = config.get_config().CONF
+    cache_dir = os.path.join(
+        CONF.get('default').get('cache_path'), DOWNLOADS_CACHE_DIR_NAME,
+        hashlib.sha256(url).hexdigest())
+    utils.create_directory(cache_dir)
+    file_path = os.path.join(cache_dir, os.path.basename(url))
+
+    # serialize downloads of the same URL by different processes
+    with open(os.path.join(cache_dir, ".lock"), "w") as lock_file:
+        fcntl.lockf(lock_file, fcntl.LOCK_EX)
+        if os.path.isfile(file_path) and checksum:
+            algorithm, hex_digest = _parse_checksum(checksum)
+            if utils.compute_file_checksum(
+                    file_path, algorithm) == hex_digest:
+                LOG.info("Using cached download of %s" % url)
+                return file_path
+            LOG.warning("Cached download of %s does not match its checksum"
+                        % url)
+            os.remove(file_path)
+
+        def _download(timeout):
+            _download_url(url, file_path, checksum, timeout)
+
+        # a download interrupted by a network failure is resumed on retry
+        utils.retry_on_timeout(
+            _download, downloader.is_network_error, initial_timeout=10)
+    return file_path
+
+
+def _download_url(url, file_path, checksum=None, timeout=None):
+    """
+    Download [url] to [file_path], streaming it in fixed size chunks and
+    hashing it on the way.
+
+    The file is first written to a partial download file, which is
+    resumed with an HTTP range request if it already exists. An
+    existing [file_path] is only downloaded again if the server reports
+    it was modified.
+
+    Raises:
+        exception.PackageDownloadChecksumError: if the downloaded file
+            does not match [checksum]
+    """
+    part_file_path = file_path + ".part"
+    validators_file_path = file_path + ".validators"
+    algorithm, hex_digest = (
+        _parse_checksum(checksum) if checksum else ("sha256", None))
+
+    validators = {}
+    if os.path.isfile(validators_file_path):
+        with open(validators_file_path) as validators_file:
+            validators = yaml.safe_load(validators_file) or {}
+    validator = validators.get("etag") or validators.get("last_modified")
+
+    headers = {}
+    if os.path.isfile(file_path):
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+    elif os.path.isfile(part_file_path) and validator:
+        headers["Range"] = "bytes=%d-" % os.path.getsize(part_file_path)
+        # the server sends the whole file if it changed meanwhile
+        headers["If-Range"] = validator
+
+    response = downloader.get_downloader().open(url, headers, timeout)
+    try:
+        if response.status == 304:
+            LOG.info("Using cached download of %s, not modified" % url)
+            return
+
+        digest = hashlib.new(algorithm)
+        if response.status == 206:
+            LOG.info("Resuming download of %s" % url)
+            with open(part_file_path, "rb") as part_file:
+                for chunk in iter(
+                        lambda: part_file.read(DOWNLOAD_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+            mode = "ab"
+        else:
+            LOG.info("Downloading %s" % url)
+            validators = {
+                "etag": response.getheader("ETag"),
+                "last_modified": response.getheader("Last-Modified"),
+            }
+            utils.write_file_atomically(
+                validators_file_path, yaml.safe_dump(validators))
+            mode = "wb"
+
+        try:
+            segmented = (
+                mode == "wb" and downloader.get_downloader().download_segments(
+                    response, part_file_path))
+        except:
+            # a partially downloaded segmented file can not be resumed
+            if os.path.exists(part_file_path):
+                os.remove(part_file_path)
+            raise
+        if segmented:
+            with open(part_file_path, "rb") as part_file:
+                for chunk in iter(
+                        lambda: part_file.read(DOWNLOAD_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+        else:
+            content_length = response.getheader("Content-Length")
+            received_length = 0
+            with open(part_file_path, mode) as part_file:
+                for chunk in iter(
+                        lambda: response.read(DOWNLOAD_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    part_file.write(chunk)
+                    received_length += len(chunk)
+            if (content_length is not None and
+                    received_length != int(content_length)):
+                raise exception.IncompleteDownloadError(
+                    url=url, received=received_length,
+                    expected=content_length)
+    finally:
+        response.close()
+
+    if hex_digest is not None and digest.hexdigest() != hex_digest:
+        os.remove(part_file_path)
+        raise exception.PackageDownloadChecksumError(
+            url=url, expected=checksum,
+            actual="%s:%s" % (algorithm, digest.hexdigest()))
+    os.rename(part_file_path, file_path)
+    LOG.debug("Downloaded %s, %s:%s" % (url, algorithm, digest.hexdigest()))
+
+
+def download(source, directory='/tmp', local_copy_subdir_name=None,
+             working_tree=True):
     """
     Download files specified by [source] to [directory].
+    If not [working_tree], git sources are fetched but not checked out.
     git and hg download to a subdir with the repository name.
     As svn has no standard URL format from which to infer the repository name, it downloads
     to a subdir named [local_copy_subdir_name]
@@ -142,7 +391,7 @@ def download(source, directory='/tmp', local_copy_subdir_name=None):
     # TODO: currently ignoring subdir_name for all sources except svn, this is
     # not consistent
     if keys == ['git']:
-        return _git_download(source, directory)
+        return _git_download(source, directory, working_tree)
     elif keys == ['hg']:
         return _hg_download(source, directory)
     elif keys == ['svn']:
@@ -153,6 +402,53 @@ def download(source, directory='/tmp', local_copy_subdir_name=None):
         raise ValueError('invalid source dict format')
 
 
+def get_remote_revision(source):
+    """
+    Get the revision the branch of a git [source] points to in its
+    remote repository, without downloading it. Only git sources are
+    supported, since upgrade-versions only updates those.
+
+    Returns:
+        str: revision, or None if [source] has no branch or is not a git
+            source
+    """
+    source_type, source_data = source.items()[0]
+    branch = source_data.get('branch')
+    if branch is None or source_type != 'git':
+        return None
+    return repository.get_remote_commit_id(source_data['src'], branch)
+
+
+def get_download_path(source, directory='/tmp', local_copy_subdir_name=None):
+    """
+    Get the path where [source] is downloaded to by the download
+    function, with the same arguments.
+    """
+    source_type, source_data = source.items()[0]
+    if source_type == 'git':
+        url_path = urlparse.urlparse(source_data['src']).path
+        name = os.path.basename(os.path.splitext(url_path)[0])
+        return os.path.join(directory, name)
+    elif source_type == 'svn':
+        return os.path.join(directory, local_copy_subdir_name)
+    elif source_type in ('hg', 'url'):
+        return os.path.join(directory, os.path.basename(source_data['src']))
+    else:
+        raise ValueError('invalid source dict format')
+
+
+def get_host(source):
+    """
+    Get the host name of the server [source] is downloaded from.
+    """
+    url = source.values()[0]['src']
+    host = urlparse.urlparse(url).hostname
+    if host is None:
+        # scp-like syntax, e.g. git@github.com:open-power-host-os/builds
+        host = url.split(':')[0].split('@')[-1]
+    return host
+
+
 def _git_archive(source, directory):
     """
     Creates a tar.gz archive for git [source] an places it in [directory].
@@ -162,7 +458,7 @@ def _git_archive(source, directory):
     git_source = source['git']
     repo = git_source['repo']
     archived_file_path = repo.archive(git_source['archive'],
-                                      git_source['commit_id'],
+                                      git_source['revision'],
                                       directory)
     git_source['archive'] = archived_file_path
     source['git'] = git_source
@@ -179,20 +475,34 @@ def _hg_archive(source, directory):
     archive_name = source['hg']['archive']
     archive_file = os.path.join(directory, archive_name + ".tar.gz")
 
-    cmd = 'hg archive -t tgz "{}"'.format(archive_file)
-    utils.run_command(cmd, cwd=source['hg']['dest'])
+    archiver.create_tar_gz(archive_file, [archiver.CommandTar(
+        ["hg", "archive", "-r", source['hg']['revision'], "-t", "tar",
+         "-p", archive_name, "-"], source['hg']['dest'])])
 
     source['hg']['archive'] = archive_file
     return source
 
 
 def _svn_archive(source, directory):
+    """
+    Exports the revision of a Subversion [source] and creates a tar.gz
+    archive of it in [directory].
+
+    Returns [source] with updated [archive] pointing to the created file.
+    """
     archive_name = source['svn']['archive']
     archive_file = os.path.join(directory, archive_name + ".tar.gz")
 
-    cmd = "tar --transform 's,^\.,{0},' -cvzf {1} . --exclude='*/.svn'".format(
-        archive_name, archive_file)
-    utils.run_command(cmd, cwd=source['svn']['dest'])
+    export_dir = tempfile.mkdtemp(dir=directory)
+    try:
+        export_path = os.path.join(export_dir, archive_name)
+        _run_remote_command('svn export --force %s "%s@%s" "%s"' % (
+            _get_svn_options(), source['svn']['src'],
+            source['svn']['revision'], export_path))
+        archiver.create_tar_gz(archive_file, [
+            archiver.DirectoryTar(export_path, archive_name)])
+    finally:
+        shutil.rmtree(export_dir)
 
     source['svn']['archive'] = archive_file
     return source
@@ -212,6 +522,7 @@ def _url_archive(source, directory):
 def archive(source, directory=''):
     """
     Create tarball archive from [source] and move it to [directory].
+    Archives of known revisions are cached, as they are reproducible.
     """
     if not source:
         raise ValueError('invalid source dict format: there are no keys')
@@ -220,13 +531,62 @@ def archive(source, directory=''):
     if len(keys) > 1:
         raise ValueError('invalid source dict format: too many keys')
 
+    if keys == ['url']:
+        # downloaded files are already cached
+        return _url_archive(source, directory)
+
+    source_type, source_data = source.items()[0]
+    cached_archive_path = _get_cached_archive_path(source)
+    if cached_archive_path and os.path.isfile(cached_archive_path):
+        LOG.info("Using cached archive of %s at revision %s"
+                 % (source_data['src'], source_data['revision']))
+        archive_path = os.path.join(
+            directory, os.path.basename(cached_archive_path))
+        utils.link_or_copy(cached_archive_path, archive_path)
+        source_data['archive'] = archive_path
+        return source
+
     if keys == ['git']:
-        return _git_archive(source, directory)
+        source = _git_archive(source, directory)
     elif keys == ['hg']:
-        return _hg_archive(source, directory)
+        source = _hg_archive(source, directory)
     elif keys == ['svn']:
-        return _svn_archive(source, directory)
-    elif keys == ['url']:
-        return _url_archive(source, directory)
+        source = _svn_archive(source, directory)
     else:
         raise ValueError('invalid source dict format: invalid key(s)')
+
+    if cached_archive_path:
+        _cache_archive(source_data['archive'], cached_archive_path)
+    return source
+
+
+def _get_cached_archive_path(source):
+    """
+    Get the path of the cached archive of a source, unique to its URL,
+    revision and archive name, or None if its revision is unknown.
+    """
+    source_data = source.values()[0]
+    if not source_data.get('revision'):
+        return None
+    CONF = config.get_config().CONF
+    key = hashlib.sha256("\0".join([
+        source_data['src'], source_data['revision'],
+        source_data['archive']])).hexdigest()
+    return os.path.join(
+        CONF.get('default').get('cache_path'), ARCHIVES_CACHE_DIR_NAME, key,
+        source_data['archive'] + ".tar.gz")
+
+
+def _cache_archive(archive_path, cached_archive_path):
+    """
+    Store an archive in the archives cache, atomically.
+    """
+    cache_dir = os.path.dirname(cached_archive_path)
+    utils.create_directory(cache_dir)
+    temp_dir = tempfile.mkdtemp(dir=cache_dir)
+    try:
+        temp_path = os.path.join(temp_dir, os.path.basename(archive_path))
+        utils.link_or_copy(archive_path, temp_path)
+        os.rename(temp_path, cached_archive_path)
+    finally:
+        shutil.rmtree(temp_dir)
@@ -13,14 +13,126 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from multiprocessing.pool import ThreadPool
+import collections
 import logging
+import threading
 
 from lib import config
 from lib import exception
+from lib import scheduler
 from lib.package import Package
 
 CONF = config.get_config().CONF
 LOG = logging.getLogger(__name__)
+DOWNLOAD_JOBS = 8
+DOWNLOAD_JOBS_PER_HOST = 4
+
+
+def download_packages(packages, recurse=True, working_tree=True,
+                      jobs=DOWNLOAD_JOBS,
+                      jobs_per_host=DOWNLOAD_JOBS_PER_HOST):
+    """
+    Download the files of packages concurrently, optionally including
+    their dependencies. Each local path (e.g. a repository shared among
+    packages) is written by one task at a time and identical sources
+    are downloaded only once.
+
+    Args:
+        packages ([Package]): packages to download
+        recurse (bool): also download packages dependencies
+        working_tree (bool): check out git sources
+        jobs (int): maximum number of concurrent downloads
+        jobs_per_host (int): maximum number of concurrent downloads from
+            the same host
+
+    Raises:
+        exception.PackageDownloadError: if any download fails
+    """
+    if recurse:
+        packages = scheduler.collect_packages(packages)
+
+    tasks_by_path = collections.OrderedDict()
+    for package in packages:
+        for path, host, source, download_f in package.get_download_tasks(
+                working_tree):
+            tasks_by_path.setdefault(path, []).append(
+                (package, host, source, download_f))
+    if not tasks_by_path:
+        return
+
+    hosts_semaphores = dict(
+        (tasks[0][1], threading.Semaphore(jobs_per_host))
+        for tasks in tasks_by_path.values())
+    failed_packages = []
+
+    def _run_path_tasks(tasks):
+        downloaded_sources = []
+        with hosts_semaphores[tasks[0][1]]:
+            for package, _, source, download_f in tasks:
+                if package in failed_packages:
+                    continue
+                identical_source = _find_identical_source(
+                    source, downloaded_sources)
+                try:
+                    if identical_source is None:
+                        download_f()
+                    else:
+                        _copy_download_result(identical_source, source)
+                except Exception:
+                    LOG.exception("%s: Failed to download files"
+                                  % package.name)
+                    failed_packages.append(package)
+                else:
+                    if source is not None:
+                        downloaded_sources.append(source)
+
+    all_packages = sorted(set(packages))
+    for package in all_packages:
+        package.lock()
+    try:
+        pool = ThreadPool(min(jobs, len(tasks_by_path)))
+        try:
+            pool.map(_run_path_tasks, tasks_by_path.values())
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        for package in all_packages:
+            package.unlock()
+
+    if failed_packages:
+        raise exception.PackageDownloadError(packages=", ".join(
+            sorted(set(package.name for package in failed_packages))))
+
+
+def _find_identical_source(source, sources):
+    """
+    Find a source in [sources] with the same type, URL and reference as
+    [source].
+    """
+    if source is None:
+        return None
+    REFERENCE_KEYS = ['src', 'commit_id', 'branch']
+    source_type, source_data = source.items()[0]
+    for other_source in sources:
+        other_source_type, other_source_data = other_source.items()[0]
+        if other_source_type == source_type and all(
+                other_source_data.get(key) == source_data.get(key)
+                for key in REFERENCE_KEYS):
+            return other_source
+    return None
+
+
+def _copy_download_result(downloaded_source, source):
+    """
+    Copy the keys set when downloading a source (e.g. the repository or
+    destination path) to an identical source.
+    """
+    downloaded_data = downloaded_source.values()[0]
+    source_data = source.values()[0]
+    for key, value in downloaded_data.items():
+        source_data.setdefault(key, value)
 
 
 class PackagesManager(object):
@@ -43,6 +155,6 @@ class PackagesManager(object):
                 LOG.error("Failed to load the %s package metadata from the git repository. "
                           "See the logs for more information" % package_name)
                 raise
-            if download_source_code:
-                package.download_files()
             self.packages.append(package)
+        if download_source_code:
+            download_packages(self.packages)
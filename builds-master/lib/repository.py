@@ -13,18 +13,69 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from multiprocessing.pool import ThreadPool
+import fcntl
+import hashlib
 import logging
 import os
+import re
+import threading
+import time
 import urlparse
 import utils
 
 import git
 import gitdb
 
+from lib import archiver
 from lib import config
 from lib import exception
 
 LOG = logging.getLogger(__name__)
+MAIN_REMOTE_NAME = "origin"
+# clone strategies: the whole history, only the checked out commits or
+# the whole history without file contents, which are fetched on demand
+CLONE_FULL = "full"
+CLONE_SHALLOW = "shallow"
+CLONE_PARTIAL = "partial"
+CLONE_STRATEGIES = [CLONE_FULL, CLONE_SHALLOW, CLONE_PARTIAL]
+# git versions older than 2.19 (e.g. CentOS 7's) lack partial clones
+DEFAULT_CLONE_STRATEGY = CLONE_FULL
+MIRRORS_DIR_NAME = "mirrors"
+ARCHIVE_MODULES_DIR_NAME = "archive-modules"
+GITLINK_MODE = "160000"
+# maximum number of submodules fetched at the same time
+SUBMODULES_JOBS = 4
+
+_paths_locks = {}
+_paths_locks_lock = threading.Lock()
+
+
+def _map_concurrently(function, items, jobs):
+    """
+    Apply a function to every item, running up to [jobs] of them at the
+    same time.
+
+    Returns:
+        list: results of the function, in the same order as the items
+    """
+    if not items:
+        return []
+    pool = ThreadPool(min(jobs, len(items)))
+    try:
+        return pool.map(function, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _get_path_lock(path):
+    """
+    Get the lock serializing threads which modify the repository at
+    [path].
+    """
+    with _paths_locks_lock:
+        return _paths_locks.setdefault(path, threading.Lock())
 
 
 class PushError(Exception):
@@ -35,13 +86,18 @@ class PushError(Exception):
         super(PushError, self).__init__(message)
 
 
-def get_git_repository(remote_repo_url, parent_dir_path):
+def get_git_repository(remote_repo_url, parent_dir_path,
+                       clone_strategy=DEFAULT_CLONE_STRATEGY, family=None):
     """
     Get a local git repository located in a subdirectory of the parent
     directory, named after the file name of the URL path (git default),
     updating the main remote URL, if needed.
     If the local repository does not exist, clone it from the remote
-    URL.
+    URL, using the clone strategy.
+
+    Full clones of repositories of the same family (e.g. forks of the
+    same upstream project) borrow objects from a mirror shared by the
+    family, instead of having their own copy of them.
     """
     # infer git repository name from its URL
     url_parts = urlparse.urlparse(remote_repo_url)
@@ -49,7 +105,6 @@ def get_git_repository(remote_repo_url, parent_dir_path):
 
     repo_path = os.path.join(parent_dir_path, name)
     if os.path.exists(repo_path):
-        MAIN_REMOTE_NAME = "origin"
         repo = GitRepository(repo_path)
         previous_url = repo.remotes[MAIN_REMOTE_NAME].url
         if previous_url != remote_repo_url:
@@ -59,44 +114,246 @@ def get_git_repository(remote_repo_url, parent_dir_path):
                               new_url=remote_repo_url))
             repo.delete_remote(MAIN_REMOTE_NAME)
             repo.create_remote(MAIN_REMOTE_NAME, remote_repo_url)
+        if clone_strategy == CLONE_FULL and repo.is_shallow:
+            repo.unshallow()
         return repo
     else:
         CONF = config.get_config().CONF
+        proxy = CONF.get('default').get('http_proxy')
+        clone_kwargs = {}
+        if family and clone_strategy == CLONE_FULL:
+            clone_kwargs["reference"] = update_git_mirror(
+                family, remote_repo_url, parent_dir_path, proxy=proxy)
         return GitRepository.clone_from(
-            remote_repo_url, repo_path,
-            proxy=CONF.get('default').get('http_proxy'))
+            remote_repo_url, repo_path, proxy=proxy,
+            clone_strategy=clone_strategy, **clone_kwargs)
 
 
-def get_svn_repository(remote_repo_url, repo_path):
+def update_git_mirror(family, remote_repo_url, parent_dir_path, proxy=None):
     """
-    Get a local subversion repository located in a directory.
-    If it does not exist, check it out from the specified URL.
+    Fetch a remote repository into the bare mirror of its family, located
+    in the mirrors subdirectory of the parent directory, creating the
+    mirror if needed. Each remote repository has its own references
+    namespace in the mirror, while objects are shared.
+
+    The mirror is used as an alternate object store by other
+    repositories, so its objects are never pruned.
+
+    Returns:
+        str: mirror path
     """
-    if os.path.exists(repo_path):
-        return SvnRepository(remote_repo_url, repo_path)
-    else:
-        # TODO: setup HTTP proxy by editing ~/.subversion/servers
-        return SvnRepository.checkout_from(remote_repo_url,
-                                           repo_path)
+    mirror_path = os.path.join(
+        parent_dir_path, MIRRORS_DIR_NAME, family + ".git")
+    with _get_path_lock(mirror_path):
+        utils.create_directory(os.path.dirname(mirror_path))
+        # also serialize updates of the mirror by different processes
+        with open(mirror_path + ".lock", "w") as lock_file:
+            fcntl.lockf(lock_file, fcntl.LOCK_EX)
+            if not os.path.exists(mirror_path):
+                LOG.info("Creating %s repositories mirror at %s"
+                         % (family, mirror_path))
+                mirror = git.Repo.init(mirror_path, bare=True)
+                with mirror.config_writer() as config_writer:
+                    config_writer.set_value("gc", "pruneExpire", "never")
+            else:
+                mirror = git.Repo(mirror_path)
+
+            namespace = hashlib.sha1(remote_repo_url).hexdigest()
+            LOG.info("Fetching %s into %s repositories mirror"
+                     % (remote_repo_url, family))
+            fetch_args = ["--no-tags", remote_repo_url,
+                          "+refs/heads/*:refs/mirrors/%s/heads/*" % namespace,
+                          "+refs/tags/*:refs/mirrors/%s/tags/*" % namespace]
+            try:
+                if proxy:
+                    mirror.git.execute(
+                        ["git", "-c", "http.proxy=%s" % proxy, "fetch"] +
+                        fetch_args)
+                else:
+                    mirror.git.fetch(*fetch_args)
+            except git.exc.GitCommandError:
+                message = ("Failed to fetch %s into %s repositories mirror"
+                           % (remote_repo_url, family))
+                LOG.exception(message)
+                raise exception.RepositoryError(message=message)
+    return mirror_path
+
+
+def _get_submodules(git_dir, commit_id):
+    """
+    Get the submodules of a commit of the repository at [git_dir], from
+    its gitlinks and .gitmodules file, without using a working tree.
+
+    Returns:
+        [(str, str, str, str)]: name, path, URL and commit ID of each
+            submodule
+    """
+    git_cmd = git.cmd.Git(git_dir)
+    gitlinks = {}
+    for line in git_cmd.ls_tree("-r", commit_id).splitlines():
+        mode_type_and_id, path = line.split("\t", 1)
+        mode, _, object_id = mode_type_and_id.split()
+        if mode == GITLINK_MODE:
+            gitlinks[path] = object_id
+    if not gitlinks:
+        return []
+
+    submodules_config = {}
+    name = None
+    for line in git_cmd.show("%s:.gitmodules" % commit_id).splitlines():
+        line = line.strip()
+        section_match = re.match(r'^\[submodule\s+"(.*)"\]$', line)
+        if section_match:
+            name = section_match.group(1)
+            submodules_config[name] = {}
+        elif name is not None and "=" in line:
+            key, value = line.split("=", 1)
+            submodules_config[name][key.strip()] = value.strip()
+
+    submodules = []
+    for name, submodule_config in sorted(submodules_config.items()):
+        path = submodule_config.get("path")
+        if path in gitlinks:
+            submodules.append(
+                (name, path, submodule_config["url"], gitlinks[path]))
+    return submodules
+
+
+def _resolve_submodule_url(parent_url, url):
+    """
+    Resolve a submodule URL relative to its parent repository URL, the
+    same way git does.
+    """
+    if not (url.startswith("./") or url.startswith("../")):
+        return url
+    if urlparse.urlparse(parent_url).scheme:
+        return urlparse.urljoin(parent_url.rstrip("/") + "/", url)
+    return os.path.normpath(os.path.join(parent_url, url))
+
+
+def _has_commit(git_dir, commit_id):
+    try:
+        git.cmd.Git(git_dir).cat_file("-e", commit_id + "^{commit}")
+    except git.exc.GitCommandError:
+        return False
+    return True
+
+
+def _run_git_command(args, cwd=None):
+    """
+    Run a git command, using the configured HTTP proxy.
+    """
+    CONF = config.get_config().CONF
+    proxy = CONF.get('default').get('http_proxy')
+    proxy_args = ["-c", "http.proxy=%s" % proxy] if proxy else []
+    return git.cmd.Git(cwd).execute(["git"] + proxy_args + args)
+
+
+def get_remote_commit_id(remote_repo_url, ref_name):
+    """
+    Get the ID of the commit a branch or tag points to in a remote
+    repository, without fetching it.
+
+    Args:
+        remote_repo_url (str): remote repository URL
+        ref_name (str): branch or tag name
+
+    Returns:
+        str: commit ID, or None if the reference does not exist
+    """
+    if _is_commit_id(ref_name):
+        return ref_name
+    try:
+        output = _run_git_command(
+            ["ls-remote", remote_repo_url, ref_name, ref_name + "^{}"])
+    except git.exc.GitCommandError as exc:
+        raise exception.RepositoryError(
+            message="Failed to list references of %s: %s"
+            % (remote_repo_url, exc.stderr))
+
+    commit_ids = {}
+    for line in output.splitlines():
+        commit_id, remote_ref_name = line.split("\t")
+        commit_ids[remote_ref_name] = commit_id
+    # annotated tags are peeled to the commit they point to
+    for remote_ref_name in ["refs/heads/%s" % ref_name,
+                            "refs/tags/%s^{}" % ref_name,
+                            "refs/tags/%s" % ref_name, ref_name]:
+        if remote_ref_name in commit_ids:
+            return commit_ids[remote_ref_name]
+    return None
+
+
+def _get_archive_module(parent_git_dir, name, url, commit_id):
+    """
+    Get the git directory of a repository containing a submodule commit,
+    to be archived without a working tree. Submodules checked out in the
+    parent repository working tree are used if they contain the commit,
+    otherwise a bare repository is kept for each submodule.
+    """
+    worktree_module_path = os.path.join(parent_git_dir, "modules", name)
+    if (os.path.isdir(worktree_module_path) and
+            _has_commit(worktree_module_path, commit_id)):
+        return worktree_module_path
+
+    module_path = os.path.join(
+        parent_git_dir, ARCHIVE_MODULES_DIR_NAME, name)
+    with _get_path_lock(module_path):
+        try:
+            if not os.path.isdir(module_path):
+                LOG.info("Cloning submodule %s from %s" % (name, url))
+                _run_git_command(["clone", "--bare", url, module_path])
+            if not _has_commit(module_path, commit_id):
+                LOG.info("Fetching submodule %s from %s" % (name, url))
+                _run_git_command(
+                    ["fetch", url, "+refs/heads/*:refs/heads/*",
+                     "+refs/tags/*:refs/tags/*"], cwd=module_path)
+            if not _has_commit(module_path, commit_id):
+                # only supported by servers allowing to fetch any commit
+                _run_git_command(["fetch", url, commit_id], cwd=module_path)
+        except git.exc.GitCommandError:
+            message = ("Failed to fetch commit %s of submodule %s from %s"
+                       % (commit_id, name, url))
+            LOG.exception(message)
+            raise exception.RepositoryError(message=message)
+    return module_path
+
+
+def _is_commit_id(ref_name):
+    """
+    Check if a git reference name is a full commit ID.
+    """
+    return re.match(r"^[0-9a-f]{40}$", ref_name) is not None
 
 
 class GitRepository(git.Repo):
 
     @classmethod
-    def clone_from(cls, remote_repo_url, repo_path, proxy=None, *args, **kwargs):
+    def clone_from(cls, remote_repo_url, repo_path, proxy=None,
+                   clone_strategy=DEFAULT_CLONE_STRATEGY, *args, **kwargs):
         """
         Clone a repository from a remote URL into a local path.
         """
-        LOG.info("Cloning repository from '%s' into '%s'" %
-                 (remote_repo_url, repo_path))
+        if clone_strategy not in CLONE_STRATEGIES:
+            raise ValueError("invalid clone strategy '%s', expected one of %s"
+                             % (clone_strategy, ", ".join(CLONE_STRATEGIES)))
+        LOG.info("Cloning repository from '%s' into '%s' (%s clone)" %
+                 (remote_repo_url, repo_path, clone_strategy))
+        if clone_strategy == CLONE_SHALLOW:
+            # only the default branch tip is transferred, other commits
+            # are fetched by checkout, one at a time, as needed
+            kwargs.update(depth=1, single_branch=True, no_checkout=True)
+        elif clone_strategy == CLONE_PARTIAL:
+            kwargs.update(filter="blob:none")
         try:
             if proxy:
                 git_cmd = git.cmd.Git()
                 git_cmd.execute(['git',
                                  '-c',
                                  "http.proxy='{}'".format(proxy),
-                                 'clone',
-                                 remote_repo_url,
+                                 'clone'] +
+                                git_cmd.transform_kwargs(**kwargs) +
+                                [remote_repo_url,
                                  repo_path])
                 return GitRepository(repo_path)
             else:
@@ -115,26 +372,85 @@ class GitRepository(git.Repo):
     def name(self):
         return os.path.basename(self.working_tree_dir)
 
-    def checkout(self, ref_name):
+    @property
+    def is_shallow(self):
+        return os.path.exists(os.path.join(self.git_dir, "shallow"))
+
+    def unshallow(self):
+        """
+        Fetch the whole history of a shallow repository.
+        """
+        LOG.info("%(name)s: Fetching the whole repository history"
+                 % dict(name=self.name))
+        try:
+            self.git.fetch("--unshallow", MAIN_REMOTE_NAME)
+        except git.exc.GitCommandError:
+            message = ("Failed to fetch the history of %s repository"
+                       % self.name)
+            LOG.exception(message)
+            raise exception.RepositoryError(message=message)
+
+    def deepen(self, commits, commit_id):
+        """
+        Fetch more commits of the history of a commit of a shallow
+        repository.
+
+        Args:
+            commits (int): number of commits the history is deepened by
+            commit_id (str): ID of the commit whose history is fetched
+        """
+        LOG.info("%(name)s: Fetching %(commits)d more commits of the "
+                 "repository history" % dict(name=self.name, commits=commits))
+        try:
+            self.git.fetch("--deepen=%d" % commits, MAIN_REMOTE_NAME,
+                           commit_id)
+        except git.exc.GitCommandError:
+            message = ("Failed to fetch the history of %s repository"
+                       % self.name)
+            LOG.exception(message)
+            raise exception.RepositoryError(message=message)
+
+    def checkout(self, ref_name, working_tree=True):
         """
         Check out the reference name, resetting the index state.
         The reference may be a branch, tag or commit.
+        If not [working_tree], the reference is only fetched and
+        resolved, leaving the working tree untouched, e.g. to archive it
+        later.
+
+        Commit IDs already present in the repository are checked out
+        without fetching, as they can not change. Other references are
+        fetched from the main remote and, if that is not enough to find
+        them, all remotes are fetched. Shallow repositories are only
+        deepened if the reference is not found otherwise.
+
+        Returns:
+            git.Commit: commit of the reference
         """
-        LOG.info("%(name)s: Fetching repository remotes"
-                 % dict(name=self.name))
-        for remote in self.remotes:
-            try:
-                remote.fetch()
-            except git.exc.GitCommandError:
-                LOG.debug("Failed to fetch %s remote for %s"
-                          % (remote.name, self.name))
-                pass
-            else:
-                LOG.info("Fetched changes for %s" % remote.name)
+        fetched = True
+        if self._is_local_commit(ref_name):
+            LOG.info("%(name)s: Commit %(ref)s found locally, skipping fetch"
+                     % dict(name=self.name, ref=ref_name))
+        elif not self._fetch_reference(ref_name):
+            fetched = self._fetch_remotes()
+
+        try:
+            commit = self._get_reference(ref_name)
+        except exception.RepositoryError:
+            if not fetched:
+                raise exception.RepositoryError(
+                    message="Reference %s not found in %s repository, whose "
+                    "remotes could not be fetched" % (ref_name, self.name))
+            if not self.is_shallow:
+                raise
+            self.unshallow()
+            commit = self._get_reference(ref_name)
+        if not working_tree:
+            return commit
 
         LOG.info("%(name)s: Checking out reference %(ref)s"
                  % dict(name=self.name, ref=ref_name))
-        self.head.reference = self._get_reference(ref_name)
+        self.head.reference = commit
         try:
             self.head.reset(index=True, working_tree=True)
         except git.exc.GitCommandError:
@@ -144,6 +460,82 @@ class GitRepository(git.Repo):
             raise exception.RepositoryError(message=message)
 
         self._update_submodules()
+        return commit
+
+    def _is_local_commit(self, ref_name):
+        """
+        Check if the reference name is a full commit ID of a commit
+        present in the repository.
+        """
+        if not _is_commit_id(ref_name):
+            return False
+        try:
+            self.commit(ref_name)
+        except (gitdb.exc.BadName, ValueError):
+            return False
+        return True
+
+    def _fetch_reference(self, ref_name):
+        """
+        Fetch a single reference, as a branch or a tag, from the main
+        remote.
+
+        Returns:
+            bool: whether the reference was found after fetching
+        """
+        if MAIN_REMOTE_NAME not in [remote.name for remote in self.remotes]:
+            return False
+        remote = self.remotes[MAIN_REMOTE_NAME]
+        if _is_commit_id(ref_name):
+            # only supported by servers allowing to fetch any commit
+            refspecs = [ref_name]
+        else:
+            refspecs = [
+                "+refs/heads/%s:refs/remotes/%s/%s"
+                % (ref_name, MAIN_REMOTE_NAME, ref_name),
+                "+refs/tags/%s:refs/tags/%s" % (ref_name, ref_name)]
+        LOG.info("%(name)s: Fetching reference %(ref)s from %(remote)s"
+                 % dict(name=self.name, ref=ref_name, remote=remote.name))
+        # keep shallow repositories shallow
+        fetch_kwargs = dict(depth=1) if self.is_shallow else {}
+        for refspec in refspecs:
+            try:
+                remote.fetch(refspec, **fetch_kwargs)
+            except git.exc.GitCommandError:
+                continue
+            else:
+                return True
+        LOG.debug("%(name)s: Reference %(ref)s could not be fetched from "
+                  "%(remote)s" % dict(name=self.name, ref=ref_name,
+                                      remote=remote.name))
+        return False
+
+    def _fetch_remotes(self):
+        """
+        Fetch all repository remotes, one after the other, since
+        concurrent fetches into the same repository contend on its
+        FETCH_HEAD and references locks. Failures are logged, since the
+        references may already be in the repository, e.g. when offline.
+
+        Returns:
+            bool: whether any remote was fetched, or there are no remotes
+        """
+        LOG.info("%(name)s: Fetching repository remotes"
+                 % dict(name=self.name))
+
+        remotes = self.remotes
+        failed_remotes = []
+        for remote in remotes:
+            try:
+                remote.fetch()
+            except git.exc.GitCommandError as exc:
+                LOG.warning("%s: Failed to fetch %s remote: %s"
+                            % (self.name, remote.name, exc.stderr))
+                failed_remotes.append(remote.name)
+            else:
+                LOG.info("Fetched changes for %s" % remote.name)
+
+        return not remotes or len(failed_remotes) < len(remotes)
 
     def _get_reference(self, ref_name):
         """
@@ -167,112 +559,133 @@ class GitRepository(git.Repo):
     def _update_submodules(self):
         """
         Update repository submodules, initializing them if needed.
+        Submodules already checked out at the commit recorded in the
+        repository are skipped and the others are updated concurrently.
         """
-        for submodule in self.submodules:
-            LOG.info("Updating submodule %(name)s from %(url)s"
-                     % dict(name=submodule.name, url=submodule.url))
-            submodule.update(init=True)
-
-    def archive(self, archive_name, commit_id, build_dir):
-        # TODO(olavph): use git.Repo.archive instead of run_command
-        archive_file = os.path.join(build_dir, archive_name + ".tar")
-
-        # Generates one tar file for each submodule.
-        cmd = ("git submodule foreach 'git archive --prefix=%s/$path/ "
-               "--format tar --output %s HEAD'" % (
-                   archive_name,
-                   os.path.join(build_dir, "$sha1-%s.tar" % archive_name)))
-        utils.run_command(cmd, cwd=self.working_tree_dir)
-
-        # Generates project's archive.
-        cmd = "git archive --prefix=%s/ --format tar --output %s HEAD" % (
-            archive_name, archive_file)
-        utils.run_command(cmd, cwd=self.working_tree_dir)
-
-        # Concatenate tar files. It's fine to fail when we don't have a
-        # submodule and thus no <submodule>-kernel-<version>.tar
-        cmd = "tar --concatenate --file %s %s" % (
-            archive_file,
-            build_dir + "/*-" + archive_name + ".tar")
+        if not os.path.exists(os.path.join(self.working_tree_dir,
+                                           ".gitmodules")):
+            return
         try:
-            utils.run_command(cmd)
-        except exception.SubprocessError:
-            pass
-
-        cmd = "gzip %s" % archive_file
-        utils.run_command(cmd)
-        return archive_file + ".gz"
+            # initialization writes the repository configuration, which
+            # can not be done concurrently
+            self.git.submodule("init")
+            status = self.git.submodule("status")
+        except git.exc.GitCommandError:
+            message = "Failed to initialize %s submodules" % self.name
+            LOG.exception(message)
+            raise exception.RepositoryError(message=message)
 
+        outdated_paths = []
+        for line in status.splitlines():
+            match = re.match(r"^([ +U-])[0-9a-f]{40} (.+?)( \(.*\))?$",
+                             line)
+            if match is None:
+                continue
+            state, path = match.group(1, 2)
+            if state == " ":
+                LOG.debug("%s: Submodule %s is up to date"
+                          % (self.name, path))
+            else:
+                outdated_paths.append(path)
 
-class SvnRepository():
+        def _update_submodule(path):
+            LOG.info("%s: Updating submodule %s" % (self.name, path))
+            start_time = time.time()
+            try:
+                self.git.submodule("update", "--", path)
+            except git.exc.GitCommandError:
+                LOG.exception("%s: Failed to update submodule %s"
+                              % (self.name, path))
+                return False
+            LOG.info("%s: Updated submodule %s in %.1fs"
+                     % (self.name, path, time.time() - start_time))
+            return True
+
+        results = _map_concurrently(
+            _update_submodule, outdated_paths, SUBMODULES_JOBS)
+        if not all(results):
+            raise exception.RepositoryError(
+                message="Failed to update %s submodules" % self.name)
 
-    @classmethod
-    def checkout_from(cls, remote_repo_url, repo_path):
+    def archive(self, archive_name, commit_id, build_dir):
         """
-        Checkout a repository from a remote URL into a local path.
+        Create a gzipped tar archive of a commit, including its
+        submodules, in the build directory. The repository and its
+        submodules are streamed into a single archive, in one pass.
+
+        If [commit_id] is None, the commit checked out in the working
+        tree is archived, along with its checked out submodules.
+        Otherwise, the commit is archived straight from the object store,
+        without a working tree, so that different commits may be
+        archived at the same time.
+
+        Returns:
+            str: archive file path
         """
-        LOG.info("Checking out repository from '%s' into '%s'" %
-                 (remote_repo_url, repo_path))
-
-        command = 'svn checkout '
-
-        CONF = config.get_config().CONF
-        proxy = CONF.get('default').get('http_proxy')
-
-        if proxy:
-            url = urlparse.urlparse(proxy)
-            host = url.scheme + '://' + url.hostname
-            port = url.port
-            options = ("servers:global:http-proxy-host='%s'" % host,
-                       "servers:global:http-proxy-port='%s'" % port)
-
-            proxy_conf = ['--config-option ' + option for option in options]
-
-            command += ' '.join(proxy_conf) + ' '
-
-        command += '%(remote_repo_url)s %(local_target_path)s' % \
-                   {'remote_repo_url': remote_repo_url,
-                    'local_target_path': repo_path}
+        archive_file = os.path.join(build_dir, archive_name + ".tar.gz")
         try:
-            utils.run_command(command)
-            return SvnRepository(remote_repo_url, repo_path)
-        except:
-            message = "Failed to clone repository"
+            if commit_id is None:
+                tars = self._get_working_tree_archive_tars(archive_name)
+            else:
+                LOG.info("%(name)s: Archiving commit %(commit)s"
+                         % dict(name=self.name, commit=commit_id))
+                tars = self._get_commit_archive_tars(
+                    self.git_dir, self.remotes[MAIN_REMOTE_NAME].url,
+                    commit_id, archive_name)
+        except git.exc.GitCommandError:
+            message = ("Failed to archive commit %s of %s repository"
+                       % (commit_id, self.name))
             LOG.exception(message)
             raise exception.RepositoryError(message=message)
 
-    def __init__(self, remote_repo_url, local_repo_path):
-        self.url = remote_repo_url
-        self.working_copy_dir = local_repo_path
-        LOG.info("Found existent repository at destination path %s" % local_repo_path)
+        archiver.create_tar_gz(archive_file, tars)
+        return archive_file
 
-    @property
-    def name(self):
-        return os.path.basename(self.working_copy_dir)
+    def _get_commit_archive_tars(self, git_dir, remote_url, commit_id,
+                                 prefix):
+        """
+        Get the tar streams of a commit of the repository at [git_dir],
+        and of its submodules, recursively.
 
-    def checkout(self, revision):
+        Returns:
+            [archiver.CommandTar]: tar streams
         """
-        Check out a revision.
+        tars = [archiver.CommandTar(
+            ["git", "archive", "--prefix=%s/" % prefix, "--format=tar",
+             commit_id], git_dir)]
+        submodules = _get_submodules(git_dir, commit_id)
+
+        def _get_module(submodule):
+            name, _, url, module_commit_id = submodule
+            start_time = time.time()
+            module_git_dir = _get_archive_module(
+                git_dir, name, _resolve_submodule_url(remote_url, url),
+                module_commit_id)
+            LOG.debug("%s: Got submodule %s in %.1fs"
+                      % (self.name, name, time.time() - start_time))
+            return module_git_dir
+
+        modules_git_dirs = _map_concurrently(
+            _get_module, submodules, SUBMODULES_JOBS)
+        for (_, path, url, module_commit_id), module_git_dir in zip(
+                submodules, modules_git_dirs):
+            tars += self._get_commit_archive_tars(
+                module_git_dir, _resolve_submodule_url(remote_url, url),
+                module_commit_id, "%s/%s" % (prefix, path))
+        return tars
+
+    def _get_working_tree_archive_tars(self, prefix):
         """
-        LOG.info("%(name)s: Updating svn repository"
-                 % dict(name=self.name))
-        try:
-            utils.run_command("svn update", cwd=self.working_copy_dir)
-        except:
-            LOG.debug("%(name)s: Failed to update svn repository"
-                      % dict(name=self.name))
-            pass
-        else:
-            LOG.info("%(name)s: Updated svn repository" % dict(name=self.name))
-
-        LOG.info("%(name)s: Checking out revision %(revision)s"
-                 % dict(name=self.name, revision=revision))
-        try:
-            utils.run_command("svn checkout %(repo_url)s@%(revision)s ." %
-                dict(repo_url=self.url, revision=revision),
-                cwd=self.working_copy_dir)
-        except:
-            message = ("Could not find revision %s at %s repository"
-                       % (revision, self.name))
-            LOG.exception(message)
-            raise exception.RepositoryError(message=message)
+        Get the tar streams of the commits checked out in the working
+        tree and in its submodules.
+        """
+        tars = [archiver.CommandTar(
+            ["git", "archive", "--prefix=%s/" % prefix, "--format=tar",
+             "HEAD"], self.working_tree_dir)]
+        for submodule in self.submodules:
+            tars.append(archiver.CommandTar(
+                ["git", "archive",
+                 "--prefix=%s/%s/" % (prefix, submodule.path),
+                 "--format=tar", "HEAD"],
+                submodule.module().working_tree_dir))
+        return tars
@@ -13,47 +13,208 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from collections import OrderedDict
+import heapq
 import logging
 
+from lib import exception
+
 LOG = logging.getLogger(__name__)
+# Estimated build duration, in seconds, of packages never built before
+DEFAULT_BUILD_DURATION = 10 * 60
+
+
+def collect_packages(packages):
+    """
+    Return the list of packages, including all dependencies, in
+    discovery order.
+    """
+    collected_packages = []
+    collected_names = set()
+    to_visit = list(reversed(packages))
+    while to_visit:
+        package = to_visit.pop()
+        if package.name in collected_names:
+            continue
+        collected_names.add(package.name)
+        collected_packages.append(package)
+        # runtime dependencies do not need to be built before the
+        # package, they can be built anytime. We randomly chose to
+        # prioritize building installation dependencies before the
+        # package.
+        to_visit.extend(reversed(package.build_dependencies))
+        to_visit.extend(reversed(package.install_dependencies))
+    return collected_packages
+
+
+def find_dependent_packages(packages, packages_names):
+    """
+    Find the packages that depend, directly or indirectly, on any of the
+    named packages, including the named packages themselves.
+
+    Args:
+        packages ([Package]): packages to search, along with their
+            dependencies
+        packages_names (set): names of the packages depended on
+
+    Returns:
+        [Package]: dependent packages, in discovery order
+    """
+    collected_packages = collect_packages(packages)
+    dependents_names = dict(
+        (package.name, []) for package in collected_packages)
+    for package in collected_packages:
+        for dep in package.install_dependencies + package.build_dependencies:
+            dependents_names[dep.name].append(package.name)
+
+    found_names = set()
+    to_visit = [name for name in packages_names if name in dependents_names]
+    while to_visit:
+        name = to_visit.pop()
+        if name not in found_names:
+            found_names.add(name)
+            to_visit.extend(dependents_names[name])
+    return [package for package in collected_packages
+            if package.name in found_names]
 
 
 class Scheduler(object):
     """
-    A *very primitive* scheduler just to deal with dependencies between the
-    packages we build. In the case qemu needs libseccomp, but this may become
-    more useful once kimchi, ginger, wok and some other projects at
+    A simple scheduler to deal with dependencies between the packages we
+    build. In the case qemu needs libseccomp, but this may become more
+    useful once kimchi, ginger, wok and some other projects at
     open-power-host-os namespace are added.
     This class basically returns a tuple containing the best order to build
-    things.
+    things. After scheduling, the [waves] attribute contains lists of
+    packages which only depend on packages of previous waves, and thus may
+    be built concurrently.
+
+    Packages whose dependents chain takes longer to build (critical path)
+    come first, so that parallel builds finish as soon as possible. Build
+    durations are estimated from previous builds.
     """
+    def __init__(self, durations=None,
+                 default_duration=DEFAULT_BUILD_DURATION):
+        """
+        Args:
+            durations (dict): previous build duration, in seconds, of each
+                package name
+            default_duration (int): build duration estimate of packages
+                not present in [durations]
+        """
+        self.durations = durations or {}
+        self.default_duration = default_duration
+        self.priorities = {}
+        self.waves = []
+
     def __call__(self, packages):
         self.packages = packages
         LOG.info("Scheduling packages and their dependecies: %s" % packages)
-        ordered_packages = self._dfs(packages, [])
+        ordered_packages, self.waves = self._schedule(packages)
         LOG.debug("Scheduled order: %s" % ordered_packages)
+        LOG.debug("Scheduled waves: %s" % self.waves)
         return tuple(ordered_packages)
 
-    def _dfs(self, packages, visited):
+    def _schedule(self, packages):
+        """
+        Sort packages topologically (Kahn's algorithm), grouping them in
+        waves of packages whose dependencies are all in previous waves.
+        Among the packages ready to be built, the ones with the longest
+        estimated chain of dependents are scheduled first.
+
+        Returns:
+            tuple: ordered list of packages and list of waves
+
+        Raises:
+            exception.PackageDependencyCycleError: if packages
+                dependencies have a cycle
+        """
+        collected_packages = collect_packages(packages)
+        packages_by_name = {}
+        discovery_index = {}
+        dependencies_names = {}
+        dependents_names = {}
+        for index, package in enumerate(collected_packages):
+            packages_by_name[package.name] = package
+            discovery_index[package.name] = index
+            dependencies_names[package.name] = set(
+                [dep.name for dep in package.install_dependencies] +
+                [dep.name for dep in package.build_dependencies])
+            dependents_names[package.name] = []
+        for name, deps_names in dependencies_names.iteritems():
+            for dep_name in deps_names:
+                dependents_names[dep_name].append(name)
+
+        initial_dependencies_count = dict(
+            (name, len(deps_names))
+            for name, deps_names in dependencies_names.iteritems())
+        missing_dependencies_count = dict(initial_dependencies_count)
+        waves = []
+        wave_names = [package.name for package in collected_packages
+                      if not missing_dependencies_count[package.name]]
+        while wave_names:
+            waves.append([packages_by_name[name] for name in wave_names])
+            next_wave_names = []
+            for name in wave_names:
+                for dependent_name in dependents_names[name]:
+                    missing_dependencies_count[dependent_name] -= 1
+                    if not missing_dependencies_count[dependent_name]:
+                        next_wave_names.append(dependent_name)
+            wave_names = next_wave_names
+
+        if sum(len(wave) for wave in waves) < len(packages_by_name):
+            cycle = self._find_cycle(
+                dependencies_names, missing_dependencies_count)
+            raise exception.PackageDependencyCycleError(
+                cycle=" -> ".join(cycle))
+
+        # the priority of a package is the estimated duration of the
+        # longest chain of builds starting at it
+        priorities = {}
+        for wave in reversed(waves):
+            for package in wave:
+                dependents_priorities = [
+                    priorities[dependent_name]
+                    for dependent_name in dependents_names[package.name]]
+                priorities[package.name] = (
+                    self.durations.get(package.name, self.default_duration) +
+                    max(dependents_priorities or [0]))
+        self.priorities = priorities
+
+        def _sort_key(name):
+            return (-priorities[name], discovery_index[name])
+
+        for wave in waves:
+            wave.sort(key=lambda package: _sort_key(package.name))
+
+        missing_dependencies_count = initial_dependencies_count
+        ready_names = [(_sort_key(package.name), package.name)
+                       for package in waves[0]] if waves else []
+        ordered_packages = []
+        while ready_names:
+            _, name = heapq.heappop(ready_names)
+            ordered_packages.append(packages_by_name[name])
+            for dependent_name in dependents_names[name]:
+                missing_dependencies_count[dependent_name] -= 1
+                if not missing_dependencies_count[dependent_name]:
+                    heapq.heappush(ready_names,
+                                   (_sort_key(dependent_name), dependent_name))
+        return ordered_packages, waves
+
+    def _find_cycle(self, dependencies_names, missing_dependencies_count):
         """
-        Return a list containing unique package names.
+        Find a dependency cycle among the packages that could not be
+        scheduled. Each of them depends on at least another one which
+        could not be scheduled either, so following those dependencies
+        eventually leads to a cycle.
         """
-        order = []
-        try:
-            p = packages[0]
-        except IndexError:
-            pass
-        else:
-            if p not in visited:
-                visited.append(p)
-                # runtime dependencies do not need to be built before the package,
-                # they can be built anytime. We randomly chose to prioritize building
-                # installation dependencies before the package.
-                if p.install_dependencies:
-                    order.extend(self._dfs(p.install_dependencies, visited))
-                if p.build_dependencies:
-                    order.extend(self._dfs(p.build_dependencies, visited))
-                order.append(p)
-            order.extend(self._dfs(packages[1:], visited))
-        return list(OrderedDict.fromkeys(order))
+        unscheduled_names = [name for name, count
+                             in missing_dependencies_count.items() if count]
+        name = min(unscheduled_names)
+        path = []
+        path_indexes = {}
+        while name not in path_indexes:
+            path_indexes[name] = len(path)
+            path.append(name)
+            name = min(dep_name for dep_name in dependencies_names[name]
+                       if missing_dependencies_count[dep_name])
+        return path[path_indexes[name]:] + [name]
@@ -0,0 +1,340 @@
+
+# Copyright (C) IBM Corp. 2016.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import logging
+import os
+import re
+import time
+
+import yaml
+
+from lib import exception
+from lib import utils
+
+LOG = logging.getLogger(__name__)
+CHANGE_LOG_TAG = "%changelog"
+# maximum depth of nested macros expanded
+MAX_MACRO_EXPANSION_DEPTH = 10
+
+
+class SpecFile(object):
+
+    # tags queried at once, in a single rpmspec run
+    COMMON_TAGS = ["name", "epoch", "version", "release", "summary",
+                   "license", "url"]
+    TAGS_SEPARATOR = "|@|"
+
+    def __init__(self, path, rpmmacro=None, distro=None, cache_dir=None):
+        """
+        Args:
+            path (str): spec file path
+            rpmmacro (str): RPM macros file used to build the spec. Tags
+                queries do not load it.
+            distro (LinuxDistribution): distro the spec is built for
+            cache_dir (str): directory where queried tags are cached
+                across runs. If None, they are cached only in memory.
+        """
+        self.path = path
+        self.rpmmacro = rpmmacro
+        self.distro = distro
+        self.cache_dir = cache_dir
+        self._content = None
+        self._cached_tags = dict()
+
+    @property
+    def content(self):
+        """
+        Get and cache the content of the spec file.
+        """
+        if self._content is None:
+            with open(self.path, 'r') as file_:
+                self._content = file_.read()
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        """
+        Set the cached content of the spec file.
+        """
+        self._content = value
+
+    def write_content(self):
+        """
+        Write the cached content to the spec file, atomically.
+        """
+        utils.write_file_atomically(self.path, self._content)
+        self._cached_tags = dict()
+
+    def query_tag(self, tag):
+        """
+        Queries the spec file for a tag's value.
+        Cached content not yet written to the file is not considered.
+
+        The common tags are queried together and cached on disk, keyed
+        by the spec file content, the RPM macros file content and the
+        distro, so that the spec is expanded only once.
+        """
+        if tag not in self._cached_tags:
+            if tag in self.COMMON_TAGS:
+                self._cached_tags.update(self._query_common_tags())
+            else:
+                self._cached_tags[tag] = self._run_query([tag])[0]
+
+        return self._cached_tags[tag]
+
+    def _query_common_tags(self):
+        """
+        Query the common tags, using the on-disk cache.
+        """
+        cache_file_path = None
+        if self.cache_dir is not None:
+            cache_file_path = os.path.join(
+                self.cache_dir, self._compute_cache_key())
+            if os.path.isfile(cache_file_path):
+                with open(cache_file_path) as cache_file:
+                    tags = yaml.safe_load(cache_file)
+                if isinstance(tags, dict):
+                    return tags
+
+        tags = dict(zip(self.COMMON_TAGS, self._run_query(self.COMMON_TAGS)))
+        if cache_file_path is not None:
+            utils.create_directory(self.cache_dir)
+            utils.write_file_atomically(cache_file_path, yaml.safe_dump(tags))
+        return tags
+
+    def _compute_cache_key(self):
+        # the RPM macros file is not part of the key, since rpmspec is
+        # run without it, with the host macros only
+        digest = hashlib.sha256()
+        digest.update("%s\0" % os.path.basename(self.path))
+        digest.update(utils.compute_file_checksum(self.path))
+        if self.distro is not None:
+            digest.update("%s\0%s\0" % (
+                self.distro.lsb_name, self.distro.version))
+        digest.update(" ".join(self.COMMON_TAGS))
+        return digest.hexdigest()
+
+    def _run_query(self, tags):
+        """
+        Query the spec file for tags values, in a single rpmspec run.
+        """
+        query_format = self.TAGS_SEPARATOR.join(
+            "%%{%s}" % tag.upper() for tag in tags)
+        output = utils.run_command(
+            "rpmspec --srpm -q --qf '%s' %s 2>/dev/null" % (
+                query_format, self.path))
+        return [value.strip() for value in output.split(self.TAGS_SEPARATOR)]
+
+    def update_version(self, new_version):
+        """
+        Update the version in the cached content, setting the release to
+        0, so that the next release bump sets it to 1.
+        """
+        LOG.info("Updating '%s' version to: %s" % (self.path, new_version))
+
+        old_version = re.search(r'Version:\s*(\S+)', self.content).group(1)
+
+        # we accept the Version tag in the format: xxx or %{xxx},
+        # but not: xxx%{xxx}, %{xxx}xxx or %{xxx}%{xxx} because
+        # there is no reliable way of knowing what the macro
+        # represents in these cases.
+        if re.match(r'(.+%{.*}|%{.*}.+)', old_version):
+            raise exception.PackageSpecError("Failed to parse spec file "
+                                             "'Version' tag")
+
+        if "%{" in old_version:
+            macro_name = old_version[2:-1]
+            self._replace_macro_definition(macro_name, new_version)
+        else:
+            self.content = re.sub(r'(Version:\s*)\S+',
+                             r'\g<1>' + new_version, self.content)
+
+        # since the version was updated, set the Release to 0. When
+        # the release bump is made, it will increment to 1.
+        self.content = re.sub(r'(Release:\s*)[\w.-]+', r'\g<1>0', self.content)
+
+    def bump_release(self, change_log_lines, user_name, user_email):
+        """
+        Increment the release in the cached content and add a change log
+        entry for it, as rpmdev-bumpspec does.
+        """
+        release_match = re.search(r'^Release:[ \t]*(\S+)', self.content,
+                                  re.MULTILINE)
+        if release_match is None:
+            raise exception.PackageSpecError("Failed to parse spec file "
+                                             "'Release' tag")
+        release = release_match.group(1)
+        macro_match = re.match(r'%{\??(\w+)}', release)
+        if macro_match and self._get_macro_definition(macro_match.group(1)):
+            # release number defined by a macro, e.g. %{baserelease}
+            macro_name = macro_match.group(1)
+            self._replace_macro_definition(macro_name, _increment_release(
+                self._get_macro_definition(macro_name)))
+        else:
+            self.content = (self.content[:release_match.start(1)] +
+                            _increment_release(release) +
+                            self.content[release_match.end(1):])
+
+        header = "* %s %s <%s> - %s" % (
+            time.strftime("%a %b %d %Y"), user_name, user_email,
+            self._get_evr())
+        entry = "\n".join(
+            [header] + ['- ' + l for l in change_log_lines]) + "\n\n"
+
+        body, change_log = self._split_change_log()
+        if not change_log:
+            if not body.endswith("\n"):
+                body += "\n"
+            change_log = CHANGE_LOG_TAG + "\n"
+        tag_line_end = change_log.find("\n") + 1
+        if not tag_line_end:
+            # the spec ends with the change log tag
+            change_log += "\n"
+            tag_line_end = len(change_log)
+        self.content = (body + change_log[:tag_line_end] + entry +
+                        change_log[tag_line_end:])
+
+    def update_prerelease_tag(self, new_prerelease):
+        """
+        Update the prerelease macro definition in the cached content.
+        """
+        self._replace_macro_definition('prerelease', new_prerelease)
+        LOG.info("Updated '%s' prerelease tag to: %s"
+                 % (self.path, new_prerelease))
+
+    def update_commit_id(self, old_commit_id, new_commit_id):
+        """
+        Replace a commit ID in the cached content, except in the change
+        log, which may contain old commit IDs that must not be replaced.
+        """
+        body, change_log = self._split_change_log()
+        self.content = body.replace(old_commit_id, new_commit_id) + change_log
+
+    def _split_change_log(self):
+        """
+        Split the cached content in the part before the change log and
+        the change log itself, which is empty if not present.
+        """
+        match = re.search(r'^%s' % CHANGE_LOG_TAG, self.content, re.MULTILINE)
+        if match is None:
+            return (self.content, "")
+        return (self.content[:match.start()], self.content[match.start():])
+
+    def _get_evr(self):
+        """
+        Get the epoch, version and release from the cached content, as
+        written in change log entries, without the distro tag.
+        """
+        values = {}
+        for tag in ["Epoch", "Version", "Release"]:
+            match = re.search(r'^%s:[ \t]*(\S+)' % tag, self.content,
+                              re.MULTILINE)
+            values[tag] = match and self._expand_macros(match.group(1))
+        evr = "%s-%s" % (values["Version"], values["Release"])
+        if values["Epoch"]:
+            evr = "%s:%s" % (values["Epoch"], evr)
+        return evr
+
+    def _expand_macros(self, value, depth=0):
+        """
+        Expand the macros defined in the cached content, in the forms
+        %{name}, %{?name}, %{?name:value} and %{!?name:value}. %{nil}
+        and conditional macros which are not defined, like %{?dist}, are
+        expanded to an empty string. Other undefined macros are kept.
+        """
+        if depth > MAX_MACRO_EXPANSION_DEPTH:
+            raise exception.PackageSpecError(
+                "Failed to expand spec file macros in '%s'" % value)
+        expanded = []
+        position = 0
+        while True:
+            start = value.find("%{", position)
+            end = _find_closing_brace(value, start + 2) if start >= 0 else -1
+            if end < 0:
+                expanded.append(value[position:])
+                return "".join(expanded)
+            expanded.append(value[position:start])
+            expanded.append(
+                self._expand_macro(value[start + 2:end], depth))
+            position = end + 1
+
+    def _expand_macro(self, macro, depth):
+        """
+        Expand the content of a macro reference, between its braces.
+        """
+        match = re.match(r'(!?)(\??)(\w+)(?::(.*))?$', macro, re.DOTALL)
+        if match is None:
+            return "%{" + macro + "}"
+        negated, conditional, macro_name, conditional_value = match.groups()
+        if macro_name == "nil":
+            return ""
+        definition = self._get_macro_definition(macro_name)
+
+        if not conditional:
+            if definition is None:
+                return "%{" + macro + "}"
+            return self._expand_macros(definition, depth + 1)
+        if (definition is not None) == bool(negated):
+            return ""
+        if conditional_value is not None:
+            return self._expand_macros(conditional_value, depth + 1)
+        return "" if negated else self._expand_macros(definition, depth + 1)
+
+    def _get_macro_definition(self, macro_name):
+        match = re.search(r'%%(?:define|global)\s+%s\s+(\S+)' % macro_name,
+                          self.content)
+        return match and match.group(1)
+
+    def _replace_macro_definition(self, macro_name, replacement):
+        """
+        Updates the file content cache, replacing the macro value.
+        """
+        self.content = re.sub(r'(%%(?:define|global)\s+%s\s+)\S+' % macro_name,
+                              r'\g<1>' + replacement, self.content)
+
+
+def _increment_release(release):
+    """
+    Increment the release number, which is the number following "0." in
+    pre-release releases (e.g. 0.1.rc1) or the leading number otherwise.
+    """
+    match = (re.match(r'(0\.)(\d+)(.*)', release) or
+             re.match(r'()(\d+)(.*)', release))
+    if match is None:
+        raise exception.PackageSpecError(
+            "Failed to increment spec file release '%s'" % release)
+    prefix, number, suffix = match.groups()
+    return "%s%d%s" % (prefix, int(number) + 1, suffix)
+
+
+def _find_closing_brace(value, start):
+    """
+    Find the brace closing a macro reference whose content starts at
+    [start], skipping nested braces.
+
+    Returns:
+        int: closing brace index, or -1 if not found
+    """
+    depth = 1
+    for index in range(start, len(value)):
+        if value[index] == "{":
+            depth += 1
+        elif value[index] == "}":
+            depth -= 1
+            if depth == 0:
+                return index
+    return -1
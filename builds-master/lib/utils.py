@@ -13,10 +13,16 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
+import errno
 import fnmatch
+import hashlib
 import logging
 import os
+import shutil
 import subprocess
+import tempfile
+import threading
 import time
 
 
@@ -114,22 +120,108 @@ def set_http_proxy_env(proxy):
 
 
 def run_command(cmd, **kwargs):
+    """
+    Run a command, streaming its output line by line to the log as it
+    is produced. Returns the command standard output.
+
+    Args:
+        cmd (str): command to run
+
+    Options:
+        shell (bool): run command through the shell. Defaults to True.
+        success_return_codes ([int]): exit codes that indicate success.
+        log_file_path (str): file where the command output is also
+            written, line by line. When set, output lines are not sent
+            to the log, since large outputs would flood it.
+        keep_output (bool): keep the whole standard output in memory to
+            return it. If False, only the last lines are returned.
+            Defaults to True.
+        Other options are passed to subprocess.Popen.
+
+    Raises:
+        exception.SubprocessError: if the command exit code is not one
+            of [success_return_codes]. It includes the last lines of the
+            command output.
+    """
     LOG.debug("Command: %s" % cmd)
     shell = kwargs.pop('shell', True)
     success_return_codes = kwargs.pop('success_return_codes', [0])
+    log_file_path = kwargs.pop('log_file_path', None)
+    keep_output = kwargs.pop('keep_output', True)
+
+    MAX_LINE_SIZE = 64 << 10
+    OUTPUT_TAIL_LINES = 100
+    output_tails = dict(stdout=collections.deque(maxlen=OUTPUT_TAIL_LINES),
+                        stderr=collections.deque(maxlen=OUTPUT_TAIL_LINES))
+    whole_output = []
+    log_file_lock = threading.Lock()
+    log_file = open(log_file_path, "a") if log_file_path else None
+
+    def _read_stream(stream, stream_name):
+        for line in iter(lambda: stream.readline(MAX_LINE_SIZE), ""):
+            output_tails[stream_name].append(line)
+            if keep_output and stream_name == "stdout":
+                whole_output.append(line)
+            if log_file:
+                with log_file_lock:
+                    log_file.write(line)
+            else:
+                LOG.debug("%s: %s" % (stream_name, line.rstrip("\n")))
+        stream.close()
+
+    start_time = time.time()
+    try:
+        if log_file:
+            LOG.debug("Command output available at %s" % log_file_path)
+            log_file.write("Command: %s\n" % cmd)
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, shell=shell,
+                                   bufsize=-1, **kwargs)
+        readers = [
+            threading.Thread(target=_read_stream, args=(stream, stream_name))
+            for stream, stream_name in ((process.stdout, "stdout"),
+                                        (process.stderr, "stderr"))]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+        process.returncode, resource_usage = _wait_process(process.pid)
+    finally:
+        if log_file:
+            log_file.close()
+
+    LOG.debug("Command finished with exit code %d. Wall time: %.1fs, user "
+              "time: %.1fs, system time: %.1fs, max RSS: %d KiB" % (
+                  process.returncode, time.time() - start_time,
+                  resource_usage.ru_utime, resource_usage.ru_stime,
+                  resource_usage.ru_maxrss))
 
-    process = subprocess.Popen(cmd, stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE, shell=shell, **kwargs)
-    output, error_output = process.communicate()
+    if process.returncode not in success_return_codes:
+        raise exception.SubprocessError(
+            cmd=cmd, returncode=process.returncode,
+            stdout="".join(output_tails["stdout"]),
+            stderr="".join(output_tails["stderr"]))
 
-    LOG.debug("stdout: %s" % output)
-    LOG.debug("stderr: %s" % error_output)
+    if keep_output:
+        return "".join(whole_output)
+    return "".join(output_tails["stdout"])
 
-    if process.returncode not in success_return_codes:
-        raise exception.SubprocessError(cmd=cmd, returncode=process.returncode,
-                                        stdout=output, stderr=error_output)
 
-    return output
+def _wait_process(pid):
+    """
+    Wait for a child process to finish, returning its exit code, in the
+    same format as subprocess.Popen.returncode, and its resource usage.
+    """
+    while True:
+        try:
+            _, status, resource_usage = os.wait4(pid, 0)
+            break
+        except OSError as exc:
+            if exc.errno != errno.EINTR:
+                raise
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status), resource_usage
+    return os.WEXITSTATUS(status), resource_usage
 
 
 def create_directory(directory):
@@ -137,7 +229,59 @@ def create_directory(directory):
     Create a directory it if it does not exist.
     """
     if not os.path.isdir(directory):
-        os.makedirs(directory)
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # the directory may have been created concurrently
+            if not os.path.isdir(directory):
+                raise
+
+
+def write_file_atomically(file_path, content):
+    """
+    Write content to a file, replacing it only after all content is
+    written, so that readers never see a partially written file.
+    """
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, temp_file_path = tempfile.mkstemp(
+        dir=directory, prefix=".%s." % os.path.basename(file_path))
+    try:
+        with os.fdopen(fd, "w") as temp_file:
+            temp_file.write(content)
+        if os.path.exists(file_path):
+            os.chmod(temp_file_path, os.stat(file_path).st_mode)
+        else:
+            os.chmod(temp_file_path, 0664)
+        os.rename(temp_file_path, file_path)
+    except:
+        os.remove(temp_file_path)
+        raise
+
+
+def compute_file_checksum(file_path, algorithm="sha256"):
+    """
+    Compute the hex digest of a file content, reading it in chunks.
+    """
+    CHUNK_SIZE = 1 << 20
+    digest = hashlib.new(algorithm)
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(source_path, dest_path):
+    """
+    Hard link a file to the destination path, replacing any existing
+    file. Fall back to copying it if the paths are in different file
+    systems.
+    """
+    if os.path.lexists(dest_path):
+        os.remove(dest_path)
+    try:
+        os.link(source_path, dest_path)
+    except OSError:
+        shutil.copy2(source_path, dest_path)
 
 
 def is_package_installed(package_name):
@@ -183,11 +327,9 @@ def recursive_glob(directory, pattern):
 
 
 def replace_str_in_file(file_path, search, replacement):
-
-    lines = []
-    with file(file_path, "r") as f:
-        lines = f.readlines()
-    with file(file_path, "w") as f:
-        for line in lines:
-            line = line.replace(search, replacement)
-            f.write(line)
+    """
+    Replace a string in a file, writing it atomically.
+    """
+    with open(file_path, "r") as f:
+        content = f.read()
+    write_file_atomically(file_path, content.replace(search, replacement))
@@ -1,8 +1,12 @@
 import logging
 import os
 
+import gitdb
+
 from lib import exception
+from lib import metadata_index
 from lib import repository
+from lib.package import OLD_DEPENDENCIES_DIRS
 
 
 LOG = logging.getLogger(__name__)
@@ -24,4 +28,44 @@ def setup_versions_repository(config):
         LOG.error("Failed to checkout versions repository")
         raise
 
+    metadata_index.load_index(
+        versions_repo, [""] + OLD_DEPENDENCIES_DIRS,
+        config.get('default').get('cache_path'))
     return versions_repo
+
+
+def get_changed_packages(versions_repo, since_commit_id):
+    """
+    Get the names of the packages whose files changed in the packages
+    metadata git repository between a commit and HEAD.
+
+    Args:
+        versions_repo (GitRepository): packages metadata git repository
+        since_commit_id (str): commit ID, or any other git reference
+
+    Returns:
+        set: changed packages names
+    """
+    try:
+        since_commit = versions_repo.commit(since_commit_id)
+    except (gitdb.exc.BadName, ValueError):
+        raise exception.RepositoryError(
+            message="Commit %s not found in versions repository"
+            % since_commit_id)
+
+    changed_packages_names = set()
+    for diff in since_commit.diff(versions_repo.head.commit):
+        for path in (diff.a_path, diff.b_path):
+            if path is None:
+                continue
+            path_parts = path.split("/")
+            if path_parts[0] in OLD_DEPENDENCIES_DIRS:
+                path_parts = path_parts[1:]
+            # files at the root of the packages directories do not
+            # belong to any package
+            if len(path_parts) > 1:
+                changed_packages_names.add(path_parts[0])
+
+    LOG.info("Packages changed since %s: %s" % (
+        since_commit_id, ", ".join(sorted(changed_packages_names))))
+    return changed_packages_names
@@ -0,0 +1,78 @@
+from nose.tools import eq_
+from nose.tools import assert_raises
+
+
+from lib import archiver
+from lib import exception
+
+
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+
+class TestArchiver(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _create_dir(self, name, files):
+        dir_path = os.path.join(self.temp_dir, name)
+        os.mkdir(dir_path)
+        for file_name, content in files.items():
+            with open(os.path.join(dir_path, file_name), "w") as f:
+                f.write(content)
+        return dir_path
+
+    def test_create_tar_gz_WithSeveralTarStreams_ShouldArchiveAllMembers(self):
+        main_dir = self._create_dir("main", {"a.txt": "a" * 1000})
+        module_dir = self._create_dir("module", {"b.txt": "b"})
+        archive_file_path = os.path.join(self.temp_dir, "pkg.tar.gz")
+
+        archiver.create_tar_gz(archive_file_path, [
+            archiver.CommandTar(
+                ["tar", "--transform=s,^\.,pkg,", "-cf", "-", "."],
+                main_dir),
+            archiver.DirectoryTar(module_dir, "pkg/module")])
+
+        with tarfile.open(archive_file_path) as archive:
+            eq_(sorted(archive.getnames()),
+                ["pkg", "pkg/a.txt", "pkg/module", "pkg/module/b.txt"])
+            eq_(archive.extractfile("pkg/a.txt").read(), "a" * 1000)
+
+    def test_create_tar_gz_WithFailingCommand_ShouldRaiseError(self):
+        archive_file_path = os.path.join(self.temp_dir, "pkg.tar.gz")
+
+        with assert_raises(exception.SubprocessError):
+            archiver.create_tar_gz(
+                archive_file_path, [archiver.CommandTar(["false"])])
+
+        eq_(os.listdir(self.temp_dir), [])
+
+    def test_create_tar_gz_WithDirectoryTar_ShouldBeReproducible(self):
+        dir_path = self._create_dir("svn", {"a.txt": "a", "b.txt": "b"})
+        os.mkdir(os.path.join(dir_path, ".svn"))
+        archives_contents = []
+
+        for mtime in [1000, 2000]:
+            os.utime(os.path.join(dir_path, "a.txt"), (mtime, mtime))
+            archive_file_path = os.path.join(self.temp_dir, "pkg.tar.gz")
+            archiver.create_tar_gz(archive_file_path, [archiver.DirectoryTar(
+                dir_path, "pkg", exclude_names=[".svn"])])
+            with open(archive_file_path, "rb") as archive_file:
+                archives_contents.append(archive_file.read())
+
+        eq_(archives_contents[0], archives_contents[1])
+        with tarfile.open(archive_file_path) as archive:
+            eq_(archive.getnames(), ["pkg", "pkg/a.txt", "pkg/b.txt"])
+
+    def test_get_member_blocks_WithBase256Size_ShouldDecodeSize(self):
+        header = ("\0" * 124 + "\x80" + "\0" * 6 + "\x02" + "\0" * 4 +
+                  "\0" * 376)
+
+        eq_(archiver._get_member_blocks(header), (2 << 32) // 512)
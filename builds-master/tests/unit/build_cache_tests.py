@@ -0,0 +1,150 @@
+from nose.tools import eq_
+
+
+from lib import config
+from lib.build_cache import BuildCache
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class _Distro(object):
+    lsb_name = "CentOS"
+    version = "7"
+
+
+class _SpecFile(object):
+
+    def __init__(self, path):
+        self.path = path
+
+
+class _Package(object):
+
+    def __init__(self, name, package_dir, sources=None,
+                 build_dependencies=None):
+        self.name = name
+        self.package_file = os.path.join(package_dir, name + ".yaml")
+        self.spec_file = _SpecFile(os.path.join(package_dir, name + ".spec"))
+        for file_path in [self.package_file, self.spec_file.path]:
+            with open(file_path, "w") as f:
+                f.write(name)
+        self.rpmmacro = None
+        self.build_files = None
+        self.download_build_files = []
+        self.sources = sources or []
+        self.clone_url = None
+        self.download_source = None
+        self.commit_id = None
+        self.build_dependencies = build_dependencies or []
+        self.result_packages = []
+
+
+class _Config(object):
+
+    def __init__(self, cache_path):
+        self.CONF = {"default": {"cache_path": cache_path}}
+
+
+class TestBuildCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.temp_dir, "build-cache")
+        self.result_dir = os.path.join(self.temp_dir, "result")
+        self.config_parser = config.config_parser
+        config.config_parser = _Config(os.path.join(self.temp_dir, "cache"))
+
+    def tearDown(self):
+        config.config_parser = self.config_parser
+        shutil.rmtree(self.temp_dir)
+
+    def _create_package(self, name, **kwargs):
+        package_dir = os.path.join(self.temp_dir, "versions", name)
+        os.makedirs(package_dir)
+        return _Package(name, package_dir, **kwargs)
+
+    def _create_built_package(self, name, **kwargs):
+        package = self._create_package(name, **kwargs)
+        rpm_path = os.path.join(self.temp_dir, name + "-1.0-1.ppc64le.rpm")
+        with open(rpm_path, "w") as rpm_file:
+            rpm_file.write(name)
+        package.result_packages.append(rpm_path)
+        return package
+
+    def _create_url_source(self, content):
+        file_path = os.path.join(self.temp_dir, "source.tar.gz")
+        with open(file_path, "w") as source_file:
+            source_file.write(content)
+        return {"url": {"src": "file://" + file_path}}
+
+    def test_restore_WithStoredBuild_ShouldRestoreRPMs(self):
+        package = self._create_built_package("foo", sources=[
+            {"git": {"src": "https://example.com/foo.git",
+                     "commit_id": "abc123"}}])
+        BuildCache(self.cache_dir, _Distro()).store(package)
+        package.result_packages = []
+
+        restored = BuildCache(self.cache_dir, _Distro()).restore(
+            package, self.result_dir)
+
+        eq_(restored, True)
+        rpm_path = os.path.join(self.result_dir, "foo-1.0-1.ppc64le.rpm")
+        eq_(package.result_packages, [rpm_path])
+        eq_(open(rpm_path).read(), "foo")
+
+    def test_restore_WithoutStoredBuild_ShouldNotRestoreRPMs(self):
+        package = self._create_package("foo")
+
+        restored = BuildCache(self.cache_dir, _Distro()).restore(
+            package, self.result_dir)
+
+        eq_(restored, False)
+        eq_(package.result_packages, [])
+
+    def test_fingerprint_WithChangedDependency_ShouldChange(self):
+        dependency = self._create_package("bar")
+        package = self._create_package("foo", build_dependencies=[dependency])
+        fingerprint = BuildCache(self.cache_dir, _Distro()).fingerprint(
+            package)
+
+        with open(dependency.spec_file.path, "a") as spec_file:
+            spec_file.write("changed")
+
+        eq_(BuildCache(self.cache_dir, _Distro()).fingerprint(package) ==
+            fingerprint, False)
+
+    def test_store_WithUnpinnedSource_ShouldNotCacheItNorDependents(self):
+        dependency = self._create_built_package("bar", sources=[
+            {"git": {"src": "https://example.com/bar.git"}}])
+        package = self._create_built_package(
+            "foo", build_dependencies=[dependency])
+        build_cache = BuildCache(self.cache_dir, _Distro())
+
+        build_cache.store(dependency)
+        build_cache.store(package)
+
+        eq_(build_cache.fingerprint(dependency), None)
+        eq_(build_cache.fingerprint(package), None)
+        eq_(os.path.exists(self.cache_dir), False)
+
+    def test_fingerprint_WithChangedURLSourceFile_ShouldChange(self):
+        package = self._create_package(
+            "foo", sources=[self._create_url_source("1.0")])
+        fingerprint = BuildCache(self.cache_dir, _Distro()).fingerprint(
+            package)
+
+        self._create_url_source("1.1")
+
+        eq_(BuildCache(self.cache_dir, _Distro()).fingerprint(package) ==
+            fingerprint, False)
+
+    def test_fingerprint_WithUnavailableURLSource_ShouldBeNone(self):
+        package = self._create_package("foo", sources=[
+            {"url": {"src": "file://" + os.path.join(
+                self.temp_dir, "missing.tar.gz")}}])
+
+        eq_(BuildCache(self.cache_dir, _Distro()).fingerprint(package), None)
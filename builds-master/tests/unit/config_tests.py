@@ -17,7 +17,11 @@ class TestConfigParser(unittest.TestCase):
         (['build-package', '--packages=foo'], 'packages', ['foo']),
         (['build-package', '--result-dir=foo'], 'result_dir', 'foo'),
         (['build-package', '--repositories-path=foo'], 'repositories_path', 'foo'),
+        (['build-package', '--cache-path=foo'], 'cache_path', 'foo'),
         (['build-package', '--keep-builddir'], 'keep_builddir', True),
+        (['build-package', '--jobs=4'], 'jobs', 4),
+        (['build-package', '--no-build-cache'], 'build_cache', False),
+        (['build-package', '--changed-since=foo'], 'changed_since', 'foo'),
         (['build-package', '--build-versions-repository-url=foo'], 'build_versions_repository_url', 'foo'),
         (['build-package', '--build-version=foo'], 'build_version', 'foo'),
         (['build-package', '--mock-args=foo'], 'mock_args', 'foo'),
@@ -30,6 +34,8 @@ class TestConfigParser(unittest.TestCase):
         (['build-iso', '--mock-args=foo'], 'mock_args', 'foo'),
         (['upgrade-versions', '--no-commit-updates'], 'commit_updates', False),
         (['upgrade-versions', '--no-push-updates'], 'push_updates', False),
+        (['upgrade-versions', '--jobs=2'], 'jobs', 2),
+        (['upgrade-versions', '--max-change-log-entries=10'], 'max_change_log_entries', 10),
     ])
     def test_parse_arguments_list_WithLongArgument_ShouldParseArgumentValue(self, arguments, key, expected):
         cfg = ConfigParser()
@@ -44,9 +50,13 @@ class TestConfigParser(unittest.TestCase):
         (['build-package'], 'log_file', '/var/log/host-os/builds.log'),
         (['build-package'], 'verbose', False),
         (['build-package'], 'keep_builddir', False),
+        (['build-package'], 'jobs', 1),
+        (['build-package'], 'build_cache', True),
+        (['build-package'], 'changed_since', None),
         (['build-package'], 'packages', None),
         (['build-package'], 'result_dir', './result'),
         (['build-package'], 'repositories_path', '/var/lib/host-os/repositories'),
+        (['build-package'], 'cache_path', '/var/lib/host-os/cache'),
         (['build-package'], 'build_versions_repository_url', None),
         (['build-package'], 'build_version', None),
         (['build-package'], 'mock_args', ''),
@@ -58,6 +68,8 @@ class TestConfigParser(unittest.TestCase):
         (['build-iso'], 'mock_args', ''),
         (['upgrade-versions'], 'commit_updates', True),
         (['upgrade-versions'], 'push_updates', True),
+        (['upgrade-versions'], 'jobs', 4),
+        (['upgrade-versions'], 'max_change_log_entries', 100),
     ])
     def test_parse_arguments_list_WithoutArgument_ShouldUseDefaultValue(self, arguments, key, expected):
         cfg = ConfigParser()
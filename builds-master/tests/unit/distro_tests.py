@@ -0,0 +1,135 @@
+from nose.tools import assert_raises
+from nose.tools import eq_
+
+
+from lib import config
+from lib import exception
+
+
+import threading
+import unittest
+
+
+class _Config(object):
+    CONF = {"default": {}}
+
+
+# lib.distro loads modules reading the configuration when imported
+if config.config_parser is None:
+    config.config_parser = _Config()
+from lib import distro
+
+
+class _Package(object):
+
+    def __init__(self, name, build_dependencies=None):
+        self.name = name
+        self.build_dependencies = build_dependencies or []
+        self.sources = [{"git": {"src": name}}]
+        self.clone_url = None
+        self.downloaded_build_files = None
+
+    def lock(self):
+        pass
+
+    def unlock(self):
+        pass
+
+    def download_files(self, recurse=True, working_tree=True,
+                       build_files=True):
+        self.downloaded_build_files = build_files
+
+
+class _PackageBuilder(object):
+
+    def __init__(self, distro, unique_extension):
+        self._distro = distro
+        self.unique_extension = unique_extension
+        self.timestamp = "now"
+        self.cleaned = False
+
+    def initialize(self):
+        if self._distro.failing_initialization:
+            raise exception.SubprocessError(
+                cmd="mock --init", returncode=1, stdout="", stderr="")
+
+    def prepare_sources(self, package):
+        pass
+
+    def build(self, package):
+        with self._distro.lock:
+            for dep in package.build_dependencies:
+                if dep.name not in self._distro.built_packages:
+                    raise AssertionError("%s built before %s"
+                                         % (package.name, dep.name))
+            self._distro.built_packages.append(package.name)
+        if package.name in self._distro.failing_packages:
+            raise exception.SubprocessError(
+                cmd="mock", returncode=1, stdout="", stderr="")
+
+    def clean(self):
+        self.cleaned = True
+
+
+class _LinuxDistribution(distro.LinuxDistribution):
+    supported_versions = ["7"]
+
+    def __init__(self):
+        super(_LinuxDistribution, self).__init__("CentOS", "7.3", "ppc64le")
+        self.package_builder = _PackageBuilder(self, None)
+        self.builders = []
+        self.built_packages = []
+        self.failing_packages = []
+        self.failing_initialization = False
+        self.lock = threading.Lock()
+
+    def create_package_builder(self, unique_extension=None):
+        builder = _PackageBuilder(self, unique_extension)
+        self.builders.append(builder)
+        return builder
+
+
+class TestLinuxDistribution(unittest.TestCase):
+
+    def setUp(self):
+        self.distro = _LinuxDistribution()
+        self.libfoo = _Package("libfoo")
+        self.foo = _Package("foo", [self.libfoo])
+        self.bar = _Package("bar", [self.foo])
+        self.baz = _Package("baz")
+
+    def test_build_packages_in_parallel_ShouldBuildDependenciesFirst(self):
+        self.distro._build_packages_in_parallel(
+            [self.libfoo, self.baz, self.foo, self.bar], jobs=3)
+
+        eq_(sorted(self.distro.built_packages),
+            ["bar", "baz", "foo", "libfoo"])
+        eq_(sorted(self.distro.build_durations),
+            ["bar", "baz", "foo", "libfoo"])
+        eq_([builder.unique_extension for builder in self.distro.builders],
+            ["now-0", "now-1", "now-2"])
+        eq_([package.downloaded_build_files for package in
+             [self.libfoo, self.baz, self.foo, self.bar]], [False] * 4)
+        eq_(all(builder.cleaned for builder in self.distro.builders), True)
+
+    def test_build_packages_in_parallel_WithFailedDependency_ShouldSkipDependents(self):
+        self.distro.failing_packages = ["libfoo"]
+
+        with assert_raises(exception.PackageBuildError):
+            self.distro._build_packages_in_parallel(
+                [self.libfoo, self.baz, self.foo, self.bar], jobs=2)
+
+        eq_(sorted(self.distro.built_packages), ["baz", "libfoo"])
+        eq_(sorted(self.distro.build_durations), ["baz"])
+        eq_(all(builder.cleaned for builder in self.distro.builders), True)
+
+    def test_build_packages_in_parallel_WithFailedInitialization_ShouldClean(self):
+        self.distro.failing_initialization = True
+
+        with assert_raises(exception.SubprocessError):
+            self.distro._build_packages_in_parallel(
+                [self.libfoo, self.baz], jobs=2)
+
+        eq_(self.distro.built_packages, [])
+        eq_(len(self.distro.builders), 2)
+        eq_(all(builder.cleaned for builder in self.distro.builders), True)
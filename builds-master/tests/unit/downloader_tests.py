@@ -0,0 +1,133 @@
+from nose.tools import eq_
+
+
+from lib import downloader
+from lib import package_source
+
+
+import BaseHTTPServer
+import SocketServer
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import yaml
+
+
+CONTENT = "".join(chr(i % 251) for i in range(100000))
+ETAG = '"abc123"'
+
+
+class _RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        range_header = self.headers.get("Range")
+        if (range_header is not None and server.honor_ranges and
+                self.headers.get("If-Range") == server.etag):
+            start, end = range_header.split("=")[1].split("-")
+            start = int(start)
+            end = int(end) if end else len(CONTENT) - 1
+            body = CONTENT[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %d-%d/%d"
+                             % (start, end, len(CONTENT)))
+        else:
+            body = CONTENT
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", server.etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+
+class TestDownloader(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.server = _HTTPServer(("127.0.0.1", 0), _RequestHandler)
+        self.server.requests = []
+        self.server.honor_ranges = True
+        self.server.etag = ETAG
+        self.server_thread = threading.Thread(
+            target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.url = "http://127.0.0.1:%d/file.tar.gz" % self.server.server_port
+        self.file_path = os.path.join(self.temp_dir, "file.tar.gz")
+        self.min_segmented_size = downloader.MIN_SEGMENTED_SIZE
+        downloader.MIN_SEGMENTED_SIZE = 1000
+        downloader._downloader = downloader.Downloader(segments=4)
+
+    def tearDown(self):
+        downloader._downloader = None
+        downloader.MIN_SEGMENTED_SIZE = self.min_segmented_size
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temp_dir)
+
+    def _get_range_requests(self):
+        return sorted(request["range"] for request in self.server.requests
+                      if "range" in request)
+
+    def _read_file(self):
+        with open(self.file_path, "rb") as downloaded_file:
+            return downloaded_file.read()
+
+    def test_download_file_WithRangeSupport_ShouldDownloadSegments(self):
+        downloader.get_downloader().download_file(self.url, self.file_path)
+
+        eq_(self._read_file(), CONTENT)
+        eq_(self._get_range_requests(), [
+            "bytes=0-24999", "bytes=25000-49999", "bytes=50000-74999",
+            "bytes=75000-99999"])
+
+    def test_download_file_WithSmallFile_ShouldNotDownloadSegments(self):
+        downloader.MIN_SEGMENTED_SIZE = len(CONTENT) + 1
+
+        downloader.get_downloader().download_file(self.url, self.file_path)
+
+        eq_(self._read_file(), CONTENT)
+        eq_(len(self.server.requests), 1)
+
+    def test_download_file_WithWeakETag_ShouldNotDownloadSegments(self):
+        self.server.etag = 'W/"abc123"'
+
+        downloader.get_downloader().download_file(self.url, self.file_path)
+
+        eq_(self._read_file(), CONTENT)
+        eq_(self._get_range_requests(), [])
+
+    def test_download_file_WithRangesIgnored_ShouldDownloadWholeFile(self):
+        self.server.honor_ranges = False
+
+        downloader.get_downloader().download_file(self.url, self.file_path)
+
+        eq_(self._read_file(), CONTENT)
+        eq_(len(self._get_range_requests()), 4)
+        eq_("range" in self.server.requests[-1], False)
+
+    def test_download_url_WithPartialDownload_ShouldResumeIt(self):
+        with open(self.file_path + ".part", "wb") as part_file:
+            part_file.write(CONTENT[:30000])
+        with open(self.file_path + ".validators", "w") as validators_file:
+            yaml.safe_dump({"etag": ETAG}, validators_file)
+
+        package_source._download_url(self.url, self.file_path)
+
+        eq_(self._read_file(), CONTENT)
+        eq_(self._get_range_requests(), ["bytes=30000-"])
+        eq_(os.path.exists(self.file_path + ".part"), False)
@@ -0,0 +1,98 @@
+from nose.tools import eq_
+
+
+from lib import metadata_index
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class _Repository(object):
+
+    def __init__(self, working_tree_dir):
+        self.working_tree_dir = working_tree_dir
+        self.head = type("Head", (), dict(
+            commit=type("Commit", (), dict(hexsha="abc123"))))
+
+    def is_dirty(self, untracked_files=False):
+        return False
+
+
+class TestMetadataIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.repo_dir = tempfile.mkdtemp()
+        self._create_package("", "kernel", ["CentOS/7/kernel.spec"])
+        self._create_package("dependencies", "libfoo", [])
+        self._create_package("dependencies", "kernel", [])
+
+    def tearDown(self):
+        metadata_index._index = None
+        shutil.rmtree(self.repo_dir)
+
+    def _create_package(self, packages_dir, name, files):
+        package_dir = os.path.join(self.repo_dir, packages_dir, name)
+        for rel_path in [name + ".yaml"] + files:
+            path = os.path.join(package_dir, rel_path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "w") as f:
+                f.write("Package:\n  name: %s\n" % name)
+
+    def test_build_WithPackagesInSeveralDirs_ShouldIndexFirstOnes(self):
+        index = metadata_index.MetadataIndex.build(
+            self.repo_dir, ["", "dependencies"])
+
+        eq_(sorted(index.packages), ["kernel", "libfoo"])
+        eq_(index.get_discoverable_packages(), ["kernel"])
+        kernel = index.get_package("kernel")
+        eq_(kernel.package_file,
+            os.path.join(self.repo_dir, "kernel", "kernel.yaml"))
+        eq_(kernel.data, {"Package": {"name": "kernel"}})
+        eq_(index.get_package("missing"), None)
+
+    def test_get_package_WithIndexedFiles_ShouldNotSearchFileSystem(self):
+        index = metadata_index.MetadataIndex.build(self.repo_dir, [""])
+        shutil.rmtree(os.path.join(self.repo_dir, "kernel"))
+
+        kernel = index.get_package("kernel")
+
+        eq_(kernel.isfile(os.path.join(
+            kernel.package_dir, "CentOS/7/kernel.spec")), True)
+        eq_(kernel.isdir(os.path.join(kernel.package_dir, "CentOS/7")), True)
+        eq_(kernel.isfile(os.path.join(kernel.package_dir, "rpmmacro")),
+            False)
+
+    def test_build_WithSymlinkedDirs_ShouldIndexFilesUnderThem(self):
+        kernel_dir = os.path.join(self.repo_dir, "kernel")
+        os.symlink("7", os.path.join(kernel_dir, "CentOS", "7.2"))
+        os.symlink("..", os.path.join(kernel_dir, "CentOS", "7", "loop"))
+
+        index = metadata_index.MetadataIndex.build(self.repo_dir, [""])
+        kernel = index.get_package("kernel")
+
+        eq_(kernel.isfile(os.path.join(
+            kernel_dir, "CentOS/7.2/kernel.spec")), True)
+        eq_(kernel.isdir(os.path.join(kernel_dir, "CentOS/7/loop")), True)
+
+    def test_build_WithInvalidYAML_ShouldIndexPackageWithoutData(self):
+        with open(os.path.join(self.repo_dir, "kernel", "kernel.yaml"),
+                  "w") as f:
+            f.write("Package: [\n")
+
+        index = metadata_index.MetadataIndex.build(self.repo_dir, [""])
+
+        eq_(index.get_discoverable_packages(), ["kernel"])
+        eq_(index.get_package("kernel").data, None)
+
+    def test_load_index_WithUnwritableCacheDir_ShouldReturnIndex(self):
+        cache_dir = os.path.join(self.repo_dir, "kernel", "kernel.yaml")
+
+        index = metadata_index.load_index(
+            _Repository(self.repo_dir), [""], cache_dir)
+
+        eq_(index.get_discoverable_packages(), ["kernel"])
+        eq_(metadata_index.get_index(), index)
@@ -0,0 +1,121 @@
+from nose.tools import eq_
+from nose.tools import assert_raises
+
+
+from lib import exception
+from lib.scheduler import Scheduler
+from lib.scheduler import find_dependent_packages
+
+
+import unittest
+
+
+class FakePackage(object):
+
+    def __init__(self, name, install_dependencies=None,
+                 build_dependencies=None):
+        self.name = name
+        self.install_dependencies = install_dependencies or []
+        self.build_dependencies = build_dependencies or []
+
+    def __repr__(self):
+        return self.name
+
+
+class TestScheduler(unittest.TestCase):
+
+    def test_call_WithDependencies_ShouldScheduleDependenciesFirst(self):
+        libseccomp = FakePackage("libseccomp")
+        qemu = FakePackage("qemu", build_dependencies=[libseccomp])
+        kernel = FakePackage("kernel")
+
+        result = Scheduler()([qemu, kernel])
+
+        eq_([p.name for p in result], ["libseccomp", "qemu", "kernel"])
+
+    def test_call_WithDependencies_ShouldGroupIndependentPackagesInWaves(self):
+        wok = FakePackage("wok")
+        ginger_base = FakePackage("ginger-base", install_dependencies=[wok])
+        kimchi = FakePackage("kimchi", install_dependencies=[wok])
+        ginger = FakePackage("ginger", install_dependencies=[ginger_base])
+        scheduler = Scheduler()
+
+        scheduler([ginger, kimchi])
+
+        eq_([[p.name for p in wave] for wave in scheduler.waves],
+            [["wok"], ["ginger-base", "kimchi"], ["ginger"]])
+
+    def test_call_WithDurations_ShouldScheduleCriticalPathFirst(self):
+        libvpd = FakePackage("libvpd")
+        libseccomp = FakePackage("libseccomp")
+        qemu = FakePackage("qemu", build_dependencies=[libseccomp])
+        kernel = FakePackage("kernel")
+        durations = {"libvpd": 10, "libseccomp": 30, "qemu": 1000,
+                     "kernel": 2000}
+
+        result = Scheduler(durations)([libvpd, kernel, qemu])
+
+        eq_([p.name for p in result],
+            ["kernel", "libseccomp", "qemu", "libvpd"])
+
+    def test_call_WithUnknownDuration_ShouldUseDefaultDuration(self):
+        libvpd = FakePackage("libvpd")
+        kernel = FakePackage("kernel")
+        scheduler = Scheduler({"kernel": 2000}, default_duration=3000)
+
+        result = scheduler([kernel, libvpd])
+
+        eq_([p.name for p in result], ["libvpd", "kernel"])
+        eq_(scheduler.priorities, {"libvpd": 3000, "kernel": 2000})
+
+    def test_call_WithSharedDependency_ShouldScheduleItOnce(self):
+        libvpd = FakePackage("libvpd")
+        lsvpd = FakePackage("lsvpd", build_dependencies=[libvpd])
+        ppc64_diag = FakePackage(
+            "ppc64-diag", build_dependencies=[libvpd, lsvpd])
+
+        result = Scheduler()([ppc64_diag, lsvpd, libvpd])
+
+        eq_([p.name for p in result], ["libvpd", "lsvpd", "ppc64-diag"])
+
+    def test_call_WithCycle_ShouldRaiseErrorWithCyclePath(self):
+        a = FakePackage("a")
+        b = FakePackage("b", build_dependencies=[a])
+        c = FakePackage("c", install_dependencies=[b])
+        a.build_dependencies.append(c)
+        d = FakePackage("d", build_dependencies=[a])
+
+        with assert_raises(exception.PackageDependencyCycleError) as context:
+            Scheduler()([d])
+
+        eq_(context.exception.cycle, "a -> c -> b -> a")
+
+    def test_call_WithLongDependencyChain_ShouldNotRecurse(self):
+        packages = [FakePackage("package-0")]
+        for index in range(1, 10000):
+            packages.append(FakePackage("package-%d" % index,
+                                        build_dependencies=[packages[-1]]))
+
+        result = Scheduler()([packages[-1]])
+
+        eq_(list(result), packages)
+
+
+class TestFindDependentPackages(unittest.TestCase):
+
+    def test_find_dependent_packages_WithChangedDependency_ShouldFindAllDependents(self):
+        wok = FakePackage("wok")
+        ginger_base = FakePackage("ginger-base", install_dependencies=[wok])
+        ginger = FakePackage("ginger", build_dependencies=[ginger_base])
+        kernel = FakePackage("kernel")
+
+        result = find_dependent_packages([kernel, ginger], set(["wok"]))
+
+        eq_([p.name for p in result], ["ginger", "ginger-base", "wok"])
+
+    def test_find_dependent_packages_WithUnknownPackage_ShouldIgnoreIt(self):
+        kernel = FakePackage("kernel")
+
+        result = find_dependent_packages([kernel], set(["removed-package"]))
+
+        eq_(result, [])
@@ -0,0 +1,89 @@
+from nose.tools import eq_
+from nose_parameterized import parameterized
+
+
+from lib.spec_file import SpecFile
+
+
+import re
+import unittest
+
+
+SPEC_TEMPLATE = """%(defines)sName: foo
+Version: 2.9
+Release: %(release)s
+
+%%description
+foo
+
+%%changelog
+* Mon Jan 02 2017 Alice <alice@example.com> - 2.9-1
+- Old entry
+"""
+
+
+def _create_spec_file(release, defines=""):
+    spec_file = SpecFile("foo.spec")
+    spec_file.content = SPEC_TEMPLATE % dict(release=release, defines=defines)
+    return spec_file
+
+
+def _get_change_log_evrs(content):
+    return re.findall(r'^\* .* <.*> - (\S+)$', content, re.MULTILINE)
+
+
+class TestSpecFile(unittest.TestCase):
+
+    @parameterized.expand([
+        ("1%{?dist}", "", "2%{?dist}", "2.9-2"),
+        ("%{baserelease}%{?dist}", "%define baserelease 3\n",
+         "%{baserelease}%{?dist}", "2.9-4"),
+        ("0.1.rc2%{?dist}", "", "0.2.rc2%{?dist}", "2.9-0.2.rc2"),
+        ("1%{?prerelease}%{?dist}", "%define prerelease %{nil}\n",
+         "2%{?prerelease}%{?dist}", "2.9-2"),
+        ("1%{?prerelease:.%{prerelease}}%{?dist}",
+         "%define prerelease rc1\n",
+         "2%{?prerelease:.%{prerelease}}%{?dist}", "2.9-2.rc1"),
+        ("1%{!?prerelease:.final}%{?dist}", "",
+         "2%{!?prerelease:.final}%{?dist}", "2.9-2.final"),
+    ])
+    def test_bump_release_WithRelease_ShouldIncrementItAndExpandMacros(
+            self, release, defines, expected_release, expected_evr):
+        spec_file = _create_spec_file(release, defines)
+
+        spec_file.bump_release(["New entry"], "Bob", "bob@example.com")
+
+        eq_(re.search(r'^Release: (\S+)$', spec_file.content,
+                      re.MULTILINE).group(1), expected_release)
+        eq_(_get_change_log_evrs(spec_file.content), [expected_evr, "2.9-1"])
+        if "baserelease" in defines:
+            eq_(spec_file._get_macro_definition("baserelease"), "4")
+
+    def test_bump_release_WithoutChangeLog_ShouldAddIt(self):
+        spec_file = SpecFile("foo.spec")
+        spec_file.content = "Name: foo\nVersion: 1.0\nRelease: 1"
+
+        spec_file.bump_release(["New entry"], "Bob", "bob@example.com")
+
+        eq_(spec_file.content.split("%changelog\n")[0],
+            "Name: foo\nVersion: 1.0\nRelease: 2\n")
+        eq_(_get_change_log_evrs(spec_file.content), ["1.0-2"])
+        eq_(spec_file.content.endswith("- New entry\n\n"), True)
+
+    def test_bump_release_WithChangeLogTagAtEnd_ShouldAddEntryInNewLine(self):
+        spec_file = SpecFile("foo.spec")
+        spec_file.content = "Version: 1.0\nRelease: 1\n%changelog"
+
+        spec_file.bump_release(["New entry"], "Bob", "bob@example.com")
+
+        eq_(spec_file.content.splitlines()[2], "%changelog")
+        eq_(_get_change_log_evrs(spec_file.content), ["1.0-2"])
+
+    def test_update_commit_id_WithCommitInChangeLog_ShouldKeepIt(self):
+        spec_file = _create_spec_file("1", "%define commit abc123\n")
+        spec_file.content += "- abc123 Old commit\n"
+
+        spec_file.update_commit_id("abc123", "def456")
+
+        eq_(spec_file._get_macro_definition("commit"), "def456")
+        eq_(spec_file.content.endswith("- abc123 Old commit\n"), True)
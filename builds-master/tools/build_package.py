@@ -18,13 +18,32 @@ import logging
 from lib import config
 from lib import distro_utils
 from lib import build_manager
+from lib import packages_manager
+from lib import rpm_package
+from lib import scheduler
+from lib.versions_repository import get_changed_packages
 from lib.versions_repository import setup_versions_repository
 
 LOG = logging.getLogger(__name__)
 
 
+def get_impacted_packages(versions_repo, since_commit_id, packages_names,
+                          distro):
+    """
+    Get the names of the packages changed since a commit of the packages
+    metadata git repository, and of the packages depending on them.
+    """
+    changed_packages_names = get_changed_packages(
+        versions_repo, since_commit_id)
+    pm = packages_manager.PackagesManager(packages_names)
+    pm.prepare_packages(packages_class=rpm_package.RPM_Package,
+                        download_source_code=False, distro=distro)
+    return [package.name for package in scheduler.find_dependent_packages(
+        pm.packages, changed_packages_names)]
+
+
 def run(CONF):
-    setup_versions_repository(CONF)
+    versions_repo = setup_versions_repository(CONF)
     packages_to_build = (CONF.get('default').get('packages') or
                          config.discover_packages())
     distro = distro_utils.get_distro(
@@ -32,6 +51,15 @@ def run(CONF):
         CONF.get('default').get('distro_version'),
         CONF.get('default').get('arch_and_endianness'))
 
+    changed_since = CONF.get('default').get('changed_since')
+    if changed_since:
+        packages_to_build = get_impacted_packages(
+            versions_repo, changed_since, packages_to_build, distro)
+        if not packages_to_build:
+            LOG.info("No packages changed since %s" % changed_since)
+            return
+
     LOG.info("Building packages: %s", ", ".join(packages_to_build))
-    bm = build_manager.BuildManager(packages_to_build, distro)
+    bm = build_manager.BuildManager(packages_to_build, distro,
+                                    jobs=CONF.get('default').get('jobs'))
     bm()
@@ -70,7 +70,8 @@ def run(CONF):
     # user or log files he needs to handle permissions by his own.
     log_dir = os.path.dirname(CONF.get('default').get('log_file'))
     repo_dir = CONF.get('default').get('repositories_path')
+    cache_dir = CONF.get('default').get('cache_path')
     user = CONF.get('default').get('user')
 
     setup_user(user)
-    setup_default_directories([log_dir, repo_dir], MOCK_GROUP_ID)
+    setup_default_directories([log_dir, repo_dir, cache_dir], MOCK_GROUP_ID)
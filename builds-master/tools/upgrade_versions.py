@@ -14,15 +14,19 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from datetime import datetime
-import copy
+from multiprocessing.pool import ThreadPool
+import collections
 import logging
 import os
 import re
 
 import git
+import gitdb
 
+from lib import config
 from lib import distro_utils
 from lib import exception
+from lib import package_source
 from lib import packages_manager
 from lib import repository
 from lib import rpm_package
@@ -49,63 +53,201 @@ PACKAGES = [
 
 # prerelease strings supported as last element in the version regex
 PRERELEASE_TERMS = ['rc']
+MAX_CHANGE_LOG_ENTRIES = 100
 
 
-def _get_git_log(repo, since_id):
+def _has_commit(repo, commit_id):
+    try:
+        repo.commit(commit_id)
+    except (gitdb.exc.BadName, ValueError):
+        return False
+    return True
+
+
+def _fetch_log_history(repo, since_id, until_id, max_entries):
+    """
+    Deepen a shallow repository until it has the history between two
+    commits. Deepening stops after more than [max_entries] commits,
+    since older ones are not logged.
+
+    Returns:
+        bool: whether the history between the commits was fetched, or
+            the repository is not shallow
+    """
+    until_commit_id = repo.commit(until_id).hexsha
+    history_size = None
+    while repo.is_shallow:
+        if _has_commit(repo, since_id):
+            if repo.is_ancestor(since_id, until_commit_id):
+                return True
+            revisions = "%s..%s" % (since_id, until_commit_id)
+        else:
+            revisions = until_commit_id
+        if int(repo.git.rev_list(revisions, count=True)) > max_entries:
+            return False
+        previous_history_size = history_size
+        history_size = int(repo.git.rev_list(until_commit_id, count=True))
+        if history_size == previous_history_size:
+            # the remote has no more history to fetch
+            return False
+        repo.deepen(max_entries + 1, until_commit_id)
+    return True
+
+
+def _get_git_log(repo, since_id, until_id="HEAD",
+                 max_entries=MAX_CHANGE_LOG_ENTRIES):
     """
     Get log of commit SHA1 and short messages since the ID provided
-    (non-inclusive).
+    (non-inclusive), up to another commit (inclusive), newest first.
+
+    Args:
+        repo (GitRepository): git repository
+        since_id (str): ID of the old commit
+        until_id (str): ID of the new commit, or any other reference
+        max_entries (int): maximum number of commits in the log. A last
+            entry tells how many more commits were left out.
+
+    Returns:
+        [str]: log entries
     """
+    if (not _fetch_log_history(repo, since_id, until_id, max_entries) or
+            not _has_commit(repo, since_id)):
+        # the old commit is not in the history fetched from the remote
+        # anymore, e.g. after a force push, or it is too old to be
+        # fetched in a shallow repository
+        LOG.warning("Commit %s not found in %s, logging only the last %d "
+                    "commits" % (since_id, repo.name, max_entries))
+        revisions = until_id
+    else:
+        if not repo.is_ancestor(since_id, until_id):
+            LOG.warning("Commit %s is not an ancestor of %s in %s, logging "
+                        "the commits not reachable from it"
+                        % (since_id, until_id, repo.name))
+        revisions = "%s..%s" % (since_id, until_id)
+
     log = []
-    for commit in repo.iter_commits():
-        if commit.hexsha.startswith(since_id):
-            break
+    for commit in repo.iter_commits(revisions, max_count=max_entries + 1):
         commit_message = commit.message.split('\n')[0]
         commit_message = commit_message.replace("'", "")
         commit_message = commit_message.replace("\"", "")
         log.append("%s %s" % (commit.hexsha, commit_message))
 
+    if len(log) > max_entries:
+        log = log[:max_entries]
+        if revisions != until_id:
+            commits_count = int(repo.git.rev_list(revisions, count=True))
+            log.append("... and %d more commits"
+                       % (commits_count - max_entries))
+        else:
+            log.append("... and older commits")
     return log
 
 
-class Version(object):
+class PendingUpdate(object):
+    """
+    Update of a package main source, not yet applied to the package: a
+    copy of the source descriptor, without its downloaded state, and
+    the edits of the package spec file, kept in memory.
+    """
+
+    # source descriptor keys set when the source is downloaded
+    DOWNLOAD_KEYS = ["repo", "revision", "dest"]
+
     def __init__(self, pkg):
         self.pkg = pkg
+        self.source_type, source = pkg.sources[0].items()[0]
+        self.source = dict((key, value) for key, value in source.items()
+                           if key not in self.DOWNLOAD_KEYS)
+        spec_file = pkg.spec_file
+        self.spec_file = rpm_package.SpecFile(
+            spec_file.path, rpmmacro=spec_file.rpmmacro,
+            distro=spec_file.distro, cache_dir=spec_file.cache_dir)
+
+    def download_source(self):
+        """
+        Download the updated source, to the package source location.
+        """
+        CONF = config.get_config().CONF
+        package_source.download(
+            {self.source_type: self.source},
+            directory=CONF.get('default').get('repositories_path'),
+            local_copy_subdir_name=self.pkg.name)
+
+    def commit(self):
+        """
+        Write the spec file edits and the new commit ID to the package
+        files, and update the package.
+        """
+        old_commit_id = self.pkg.sources[0][self.source_type]["commit_id"]
+        new_commit_id = self.source["commit_id"]
+        self.spec_file.write_content()
+        if old_commit_id and old_commit_id != new_commit_id:
+            replace_str_in_file(
+                self.pkg.package_file, old_commit_id, new_commit_id)
+        self.pkg.sources[0][self.source_type]["commit_id"] = new_commit_id
+        self.pkg.spec_file = self.spec_file
+
+
+class Version(object):
+    def __init__(self, pkg, max_change_log_entries=MAX_CHANGE_LOG_ENTRIES):
+        self.pkg = pkg
+        self.max_change_log_entries = max_change_log_entries
         self._repo_prerelease = "%{nil}"
         self._repo_version = None
 
         LOG.info("%s: Current version: %s" % (self.pkg, self.pkg.version))
 
     def update(self, user_name, user_email):
-        pkg = copy.deepcopy(self.pkg)
-        pkg.sources[0]["git"]["commit_id"] = None
-        pkg.download_files(recurse=False)
-        newest_commit_id = pkg.sources[0]["git"]["repo"].head.commit.hexsha
+        """
+        Update the package to the newest commit of its source repository.
+
+        Returns:
+            bool: whether the package was updated
+        """
+        source = self.pkg.sources[0]["git"]
+        if source.get("commit_id") and source.get("branch"):
+            try:
+                remote_commit_id = package_source.get_remote_revision(
+                    self.pkg.sources[0])
+            except exception.RepositoryError:
+                LOG.warning("%s: Failed to get the remote commit of branch "
+                            "%s, fetching it" % (self.pkg, source["branch"]))
+                remote_commit_id = None
+            if (remote_commit_id is not None and
+                    remote_commit_id.startswith(source["commit_id"])):
+                LOG.debug("%s: no changes.", self.pkg)
+                return False
+
+        update = PendingUpdate(self.pkg)
+        update.source["commit_id"] = None
+        update.download_source()
+        newest_commit_id = update.source["repo"].head.commit.hexsha
 
         if newest_commit_id == self.pkg.sources[0]["git"]["commit_id"]:
             LOG.debug("%s: no changes.", self.pkg)
-            return
+            return False
 
-        pkg.sources[0]["git"]["commit_id"] = newest_commit_id
+        update.source["commit_id"] = newest_commit_id
 
-        self._read_version_from_repo(
-            pkg.sources[0]["git"]["repo"].working_tree_dir)
+        self._read_version_from_repo(update.source["repo"].working_tree_dir)
 
         change_log_header = None
         result = rpm_package.compare_versions(
             self.pkg.version, self._repo_version)
         if result < 0:
-            pkg.spec_file.update_version(self._repo_version)
+            update.spec_file.update_version(self._repo_version)
             change_log_header = "Version update"
         elif result > 0:
             raise exception.PackageError(
                 "Current version (%s) is greater than repo version (%s)" %
                 (self.pkg.version, self._repo_version))
 
-        pkg.spec_file.update_prerelease_tag(self._repo_prerelease)
-        self._bump_release(pkg, change_log_header, user_name, user_email)
+        update.spec_file.update_prerelease_tag(self._repo_prerelease)
+        self._bump_release(update, change_log_header, user_name, user_email)
+        update.commit()
+        return True
 
-    def _bump_release(self, pkg, change_log_header=None, user_name=None,
+    def _bump_release(self, update, change_log_header=None, user_name=None,
                       user_email=None):
         LOG.info("%s: Bumping release" % self.pkg)
         change_log_lines = []
@@ -114,20 +256,19 @@ class Version(object):
 
         old_commit_id = self.pkg.sources[0]["git"]["commit_id"]
         if old_commit_id:
-            new_source = pkg.sources[0]["git"]
-            new_commit_id = new_source["commit_id"]
+            new_commit_id = update.source["commit_id"]
             LOG.info("Updating package %s from %s to %s" % (
                 self.pkg.name, old_commit_id, new_commit_id))
             change_log_lines += _get_git_log(
-                new_source["repo"], old_commit_id)
-            replace_str_in_file(
-                self.pkg.package_file, old_commit_id, new_commit_id)
-            pkg.spec_file.update_commit_id(old_commit_id, new_commit_id)
+                update.source["repo"], old_commit_id, new_commit_id,
+                max_entries=self.max_change_log_entries)
+            update.spec_file.update_commit_id(old_commit_id, new_commit_id)
 
         if change_log_lines:
             assert user_name is not None
             assert user_email is not None
-            pkg.spec_file.bump_release(change_log_lines, user_name, user_email)
+            update.spec_file.bump_release(
+                change_log_lines, user_name, user_email)
 
     def _read_version_from_repo(self, repo_path):
 
@@ -172,6 +313,67 @@ class Version(object):
             raise exception.PackageError(msg)
 
 
+def update_packages(packages, updater_name, updater_email, jobs=1,
+                    max_change_log_entries=MAX_CHANGE_LOG_ENTRIES):
+    """
+    Update packages to the newest commits of their source repositories,
+    concurrently. Packages whose sources are downloaded to the same
+    local path, such as git repositories cloned to a directory named
+    after their URL, are updated one after the other, so that one does
+    not check out a commit in a local copy another one is using.
+
+    Args:
+        packages ([RPM_Package]): packages
+        updater_name (str): updater name
+        updater_email (str): updater email
+        jobs (int): number of packages updated at the same time
+        max_change_log_entries (int): maximum number of commits listed
+            in a spec file change log entry
+
+    Returns:
+        dict: whether each package was updated, or the error raised
+            while updating it, by package name
+    """
+    CONF = config.get_config().CONF
+    repositories_path = CONF.get('default').get('repositories_path')
+    packages_by_source = collections.OrderedDict()
+    for pkg in packages:
+        download_path = (package_source.get_download_path(
+            pkg.sources[0], repositories_path, pkg.name) if pkg.sources
+            else pkg.name)
+        packages_by_source.setdefault(download_path, []).append(pkg)
+
+    results = {}
+
+    def _update(source_packages):
+        for pkg in source_packages:
+            pkg.lock()
+            try:
+                results[pkg.name] = Version(
+                    pkg, max_change_log_entries).update(
+                        updater_name, updater_email)
+            except Exception as exc:
+                LOG.exception("%s: Failed to update" % pkg)
+                results[pkg.name] = exc
+            finally:
+                pkg.unlock()
+
+    pool = ThreadPool(max(1, min(jobs, len(packages_by_source))))
+    try:
+        pool.map(_update, packages_by_source.values())
+    finally:
+        pool.close()
+        pool.join()
+
+    LOG.info("Packages updates summary:")
+    for name, result in sorted(results.items()):
+        if isinstance(result, Exception):
+            LOG.info("%s: failed: %s" % (name, result))
+        else:
+            LOG.info("%s: %s" % (name, "updated" if result else "no changes"))
+    return results
+
+
 def commit_weekly_build_packages_updates(
     versions_repo, release_date, updater_name, updater_email):
     """
@@ -248,11 +450,16 @@ def run(CONF):
     pm.prepare_packages(packages_class=rpm_package.RPM_Package,
                         download_source_code=False, distro=distro)
 
-    for pkg in pm.packages:
-        pkg.lock()
-        pkg_version = Version(pkg)
-        pkg_version.update(updater_name, updater_email)
-        pkg.unlock()
+    results = update_packages(
+        pm.packages, updater_name, updater_email,
+        jobs=CONF.get('default').get('jobs'),
+        max_change_log_entries=CONF.get('default').get(
+            'max_change_log_entries'))
+    failed_packages = [name for name, result in sorted(results.items())
+                       if isinstance(result, Exception)]
+    if failed_packages:
+        raise exception.PackageError(
+            "Failed to update packages: %s" % ", ".join(failed_packages))
 
     release_date = datetime.today().date().isoformat()
     if commit_updates: